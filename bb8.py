@@ -1,12 +1,26 @@
 from bb8.bot import BB8
+from bb8.deck import Decklists
 from bb8.search import Search
-from bb8.swdestinydb import SWDestinyDBClient
+from bb8.swdestinydb import AsyncSWDestinyDBClient, CardCatalog
+from bb8.tracing import Tracer
 
 import logging
 import os
 
-db_client = SWDestinyDBClient()
-search = Search(db_client)
+
+def get_catalog_path():
+    """
+    Gets path of card catalog snapshot from environment.
+
+    :return: the path of catalog snapshot (default: catalog.json)
+    """
+    return os.environ.get("CATALOG_PATH", "catalog.json")
+
+
+db_client = AsyncSWDestinyDBClient()
+catalog = CardCatalog(db_client, path=get_catalog_path())
+search = Search(catalog)
+decklists = Decklists(db_client)
 
 
 def setup_logging():
@@ -17,6 +31,31 @@ def setup_logging():
     logging.getLogger('discord.http').setLevel(logging.WARNING)
 
 
+def get_metrics_port():
+    """
+    Gets port metrics are exported on from environment.
+
+    :return: the port or None if metrics should not be exported.
+    """
+    port = os.environ.get("METRICS_PORT")
+    return int(port) if port else None
+
+
+def get_tracer():
+    """
+    Creates tracer configured from environment.
+
+    SLOW_QUERY_MS sets the duration (default: 1000) requests are logged
+    after, PROFILE_RATE sets the fraction (default: 0) of profiled requests.
+
+    :return: the tracer of commands and mentions.
+    """
+    return Tracer(
+        threshold=float(os.environ.get("SLOW_QUERY_MS", 1000)) / 1000,
+        profile_rate=float(os.environ.get("PROFILE_RATE", 0))
+    )
+
+
 def get_token():
     """
     Gets Discord API token from environment.
@@ -35,6 +74,10 @@ def main():
     bot = BB8(
         extensions=['bb8.cogs'],
         search=search,
+        decklists=decklists,
+        incremental_refresh=True,
+        metrics_port=get_metrics_port(),
+        tracer=get_tracer(),
         command_prefix="!",
         description="Provides useful commands for Star Wars Destiny fans."
     )
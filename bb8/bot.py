@@ -1,9 +1,18 @@
 """
 This module provides BB8 bot implementation.
 """
+from concurrent.futures import ThreadPoolExecutor
 from discord.ext import commands
+from .dispatch import Dispatcher
+from .embed import EmbedCache, EmojiCache
+from .metrics import DISCORD_SEND_ERRORS, DISCORD_SEND_SECONDS, MetricsServer
+from .search import BoundedExecutor
+from .throttle import DedupWindow, UserThrottle
+from .tracing import Tracer
 
+import asyncio
 import logging
+import time
 
 
 class BB8(commands.Bot):
@@ -13,17 +22,94 @@ class BB8(commands.Bot):
     It wires all dependencies required by extensions
     and loads different cogs.
 
+    Bot owns executor, that runs card search outside of event loop.
+    Searches are rejected when `search_queue_size` of them are pending.
+    It also caches emoji substitutions of each server and rendered embeds.
+
+    Before connecting to Discord, bot loads card catalog and builds
+    search index, so first commands do not pay for cold start. Catalog
+    is then revalidated in background every `refresh_interval` seconds,
+    regardless of its ttl, so searches never wait for catalog.
+
+    If `metrics_port` is set, metrics of searches, API requests, caches,
+    rendering and Discord sends are exported on that local port
+    in Prometheus text format.
+
+    Commands and card mentions are traced by `tracer`, which logs slow
+    requests with their stage breakdown.
+
+    Replies are sent by dispatcher, which paces messages of each channel
+    and keeps at most `reply_queue_size` of them queued for `reply_max_age`
+    seconds.
+
+    Lookups repeated in channel within `dedup_window` seconds are
+    suppressed and each user can request at most `user_rate` lookups
+    per `user_per` seconds.
+
     :param list extensions: the list of extensions module names,
                             that are loaded to bot.
     :param obj search: the card search class
+    :param obj decklists: the decklists fetched from SWDestinyDB.
+    :param int search_workers: the number of search threads. (default: 4)
+    :param int search_queue_size: the maximum number of pending searches.
+                                  (default: 64)
+    :param obj search_executor: the executor running searches. Each
+                                search passes the whole index to it,
+                                so it must share memory with bot;
+                                process pools would pickle the index
+                                on every search.
+                                (default: ThreadPoolExecutor)
+    :param int refresh_interval: the number of seconds between catalog
+                                 refreshes. (default: 600)
+    :param bool incremental_refresh: whether refresh of fresh catalog
+                                     downloads only cards of changed
+                                     sets. (default: False)
+    :param int metrics_port: the local port metrics are exported on.
+                             (default: None, metrics are not exported)
+    :param obj tracer: the tracer of commands and mentions.
+                       (default: Tracer())
+    :param int reply_queue_size: the maximum number of queued replies
+                                 of channel. (default: 10)
+    :param float reply_max_age: the number of seconds reply is valid.
+                                (default: 30)
+    :param float dedup_window: the number of seconds repeated lookup
+                               is suppressed for. (default: 10)
+    :param int user_rate: the number of lookups user can request
+                          in `user_per` seconds. (default: 5)
+    :param float user_per: the throttle window in seconds. (default: 10)
     :param str command_prefix: the prefix of all commands.
     :param str description: the bot description
     """
 
-    def __init__(self, extensions, search, **options):
+    def __init__(self, extensions, search, decklists=None, search_workers=4,
+                 search_queue_size=64, search_executor=None,
+                 refresh_interval=600, incremental_refresh=False,
+                 metrics_port=None, tracer=None, reply_queue_size=10,
+                 reply_max_age=30, dedup_window=10, user_rate=5,
+                 user_per=10, **options):
         super().__init__(**options)
         self.initial_extensions = extensions
         self.search = search
+        self.decklists = decklists
+        self.executor = BoundedExecutor(
+            search_executor or ThreadPoolExecutor(search_workers),
+            search_queue_size
+        )
+        self.search.executor = self.executor
+        self.emoji_cache = EmojiCache()
+        self.embed_cache = EmbedCache()
+        self.dispatcher = Dispatcher(self.send_message,
+                                     max_pending=reply_queue_size,
+                                     max_age=reply_max_age, loop=self.loop)
+        self.dedup = DedupWindow(dedup_window)
+        self.throttle = UserThrottle(user_rate, user_per)
+        self.refresh_interval = refresh_interval
+        self.incremental_refresh = incremental_refresh
+        self.refresher = None
+        self.tracer = tracer or Tracer()
+        self.metrics = None
+        if metrics_port is not None:
+            self.metrics = MetricsServer(port=metrics_port, loop=self.loop)
         self.logger = logging.getLogger(__name__)
 
         self._load_extensions()
@@ -36,8 +122,134 @@ class BB8(commands.Bot):
             self.load_extension(extension)
             self.logger.info(f'Loaded extension {extension}')
 
+    async def start(self, *args, **kwargs):
+        """
+        Warms up bot, starts catalog refresher and metrics server
+        and connects bot to Discord.
+        """
+        if self.metrics is not None:
+            await self.metrics.start()
+            self.logger.info(f"Exporting metrics on port {self.metrics.port}")
+        await self.warmup()
+        self.refresher = self.loop.create_task(self._refresh_catalog())
+        await super().start(*args, **kwargs)
+
+    async def warmup(self):
+        """
+        Loads card catalog, local snapshot is used if it is fresh,
+        and builds search index.
+
+        Failed warmup is logged, catalog is then loaded by refresher
+        or first search.
+        """
+        timings = []
+        try:
+            start = time.perf_counter()
+            await self.search.db_client.get_cards()
+            timings.append(("catalog", time.perf_counter() - start))
+
+            start = time.perf_counter()
+            await self.search.refresh()
+            timings.append(("index", time.perf_counter() - start))
+        except Exception:
+            self.logger.exception("Warmup failed")
+
+        breakdown = ", ".join(f"{phase}: {elapsed * 1000:.0f} ms"
+                              for phase, elapsed in timings)
+        self.logger.info(f"Warmup finished ({breakdown})")
+
+    async def _refresh_catalog(self):
+        """
+        Refreshes card catalog periodically until bot is closed.
+
+        Incremental refresh is used only while catalog is fresh, stale
+        catalog is fully revalidated, so changes that do not show up
+        in sets are picked up at least once per catalog ttl. Otherwise
+        catalog is fully revalidated on every refresh.
+
+        Failed refresh is logged and previous catalog is kept.
+        """
+        while not self.is_closed:
+            await asyncio.sleep(self.refresh_interval, loop=self.loop)
+            try:
+                if (self.incremental_refresh and
+                        not self.search.db_client.is_stale()):
+                    await self.search.refresh_sets()
+                else:
+                    await self.search.refresh(revalidate=True)
+            except Exception:
+                self.logger.exception("Catalog refresh failed, "
+                                      "keeping previous catalog")
+
+    async def send_message(self, destination, content=None, **kwargs):
+        """
+        Sends message to destination, measuring its latency.
+
+        See :meth:`discord.Client.send_message`.
+        """
+        try:
+            with DISCORD_SEND_SECONDS.time():
+                return await super().send_message(destination, content,
+                                                  **kwargs)
+        except Exception:
+            DISCORD_SEND_ERRORS.inc()
+            raise
+
     async def on_ready(self, *_):
         """
-        The callback for logging that commands are ready for use.
+        The callback resolving emojis of all servers and logging
+        that commands are ready for use.
         """
+        start = time.perf_counter()
+        for server in self.servers:
+            self.emoji_cache.get(server)
+        elapsed = time.perf_counter() - start
+        self.logger.info(f"Resolved emojis of {len(self.servers)} servers "
+                         f"({elapsed * 1000:.0f} ms)")
+
         self.logger.info(f"Logged in as {self.user} with id {self.user.id}")
+
+    async def on_server_emojis_update(self, before, after):
+        """
+        The callback invalidating cached emojis of updated server.
+        """
+        emojis = after or before
+        if emojis:
+            self.emoji_cache.invalidate(emojis[0].server)
+
+    async def on_server_remove(self, server):
+        """
+        The callback removing cached emojis of server bot left.
+        """
+        self.emoji_cache.invalidate(server)
+
+    async def close(self):
+        """
+        Closes connection to Discord and stops catalog refresher,
+        reply dispatcher, metrics server, search executor and HTTP
+        sessions of SWDestinyDB clients.
+        """
+        if self.refresher is not None:
+            self.refresher.cancel()
+        await self.dispatcher.close()
+        if self.metrics is not None:
+            await self.metrics.stop()
+        await super().close()
+        self.executor.shutdown(wait=False)
+        for client in self._api_clients():
+            await client.close()
+
+    def _api_clients(self):
+        """
+        Gets distinct SWDestinyDB clients of card catalog and decklists.
+
+        :rtype: list
+        """
+        catalog = getattr(self.search, "db_client", None)
+        clients = []
+        for client in [getattr(catalog, "db_client", None),
+                       getattr(self.decklists, "db_client", None)]:
+            if (hasattr(client, "close") and
+                    not any(client is other for other in clients)):
+                clients.append(client)
+        return clients
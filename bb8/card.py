@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides compact representation of Star Wars Destiny cards.
+
+Example:
+    This example shows creating card from API response::
+
+        $ card = Card(client.get_card("01001"))
+        $ card["label"]
+"""
+from collections.abc import Mapping
+
+import sys
+
+
+class Card(Mapping):
+    """
+    Compact card record holding only fields used by bot.
+
+    Record is read-only mapping, so it can be used wherever card dict
+    is expected. Fields missing in API response behave like missing
+    dict keys. Strings repeated across cards, such as set, faction
+    or rarity names, are interned, so all cards share them.
+
+    :param dict data: the card as returned by SWDestinyDB API.
+    """
+    FIELDS = (
+        "code",
+        "name",
+        "label",
+        "set_code",
+        "set_name",
+        "position",
+        "type_code",
+        "type_name",
+        "faction_code",
+        "faction_name",
+        "affiliation_code",
+        "affiliation_name",
+        "rarity_code",
+        "rarity_name",
+        "is_unique",
+        "has_die",
+        "points",
+        "health",
+        "cost",
+        "text",
+        "sides",
+        "illustrator",
+        "url",
+        "imagesrc"
+    )
+
+    INTERNED = {
+        "set_code",
+        "set_name",
+        "type_code",
+        "type_name",
+        "faction_code",
+        "faction_name",
+        "affiliation_code",
+        "affiliation_name",
+        "rarity_code",
+        "rarity_name",
+        "illustrator"
+    }
+
+    __slots__ = FIELDS
+
+    _FIELD_SET = frozenset(FIELDS)
+
+    def __init__(self, data):
+        for field in Card.FIELDS:
+            if field not in data:
+                continue
+
+            value = data[field]
+            if field in Card.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            elif field == "sides" and value is not None:
+                value = tuple(sys.intern(side) for side in value)
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        if field not in Card._FIELD_SET or not hasattr(self, field):
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __iter__(self):
+        return (field for field in Card.FIELDS if hasattr(self, field))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "Card({!r})".format(dict(self))
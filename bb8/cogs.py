@@ -1,10 +1,21 @@
 """
 This module provides bot commands and event listeners.
 """
+from collections import OrderedDict
+from contextlib import contextmanager
 from discord.ext import commands
-from .embed import CardDetail, CardImage
+from .deck import Deck
+from .embed import DeckEmbed
+from .mentions import extract_mentions
+from .metrics import REQUESTS_SUPPRESSED
+from .search import SearchBusy, SearchIndex
+from .swdestinydb import CLIENT_ERRORS
 
 import re
+import time
+
+# Characters with special meaning in Discord markdown.
+MARKDOWN = re.compile(r"([\\*_~`|>])")
 
 
 class SWCardSearch:
@@ -15,11 +26,17 @@ class SWCardSearch:
     and send results back to enhance conversation.
 
     Cards must be mentioned in format [[term]] to be recognized by bot.
+    Replies are enqueued to bot's dispatcher instead of sent directly.
+
+    Lookups of card already requested in channel within bot's dedup
+    window are suppressed, as well as all lookups of throttled user.
+    Lookups rejected by busy search or failed are not remembered, so they
+    can be repeated right away.
 
     :param obj bot: the bot instance where command should be registered.
     """
-    # Regex to parse card mentions from regular messages.
-    PATTERN = r"\[\[(.+)\]\]"
+    # Reply sent when search executor is overloaded.
+    BUSY_MESSAGE = "I'm busy right now, try again in a moment."
 
     def __init__(self, bot):
         self.bot = bot
@@ -34,24 +51,95 @@ class SWCardSearch:
 
         :param varargs terms: list of terms to look card by
         """
-        card = self.bot.search.find_card(terms)
-        emojis = ctx.message.server.emojis
-
-        if card:
-            embed = CardDetail(card, emojis).render()
-            await self.bot.say(embed=embed)
-        else:
-            await self.bot.say("Card not found :(")
-
-    @commands.command(aliases=["cardi"], description="Search for card on Star Wars Destiny DB and show its image")
-    async def card_image(self, *, terms):
-        card = self.bot.search.find_card(terms)
-        
-        if card:
-            embed = CardImage(card).render()
-            await self.bot.say(embed=embed)
-        else:
-            await self.bot.say("Card not found :(")
+        channel = ctx.message.channel
+        if not self._admit(ctx.message, [terms]):
+            return
+
+        with self.bot.tracer.trace("card", query=terms) as trace, \
+                self._serving(ctx.message, [terms]):
+            try:
+                card = await self.bot.search.find_card(terms, trace)
+            except SearchBusy:
+                self._forget(ctx.message, [terms])
+                self.bot.dispatcher.enqueue(channel, SWCardSearch.BUSY_MESSAGE,
+                                            trace=trace)
+                return
+
+            if card:
+                with trace.span("render"):
+                    emojis = self.bot.emoji_cache.get(ctx.message.server)
+                    embed = self.bot.embed_cache.detail(card, emojis)
+                self.bot.dispatcher.enqueue(channel, embed=embed, trace=trace)
+            else:
+                self.bot.dispatcher.enqueue(channel, "Card not found :(",
+                                            trace=trace)
+
+    @commands.command(pass_context=True, aliases=["cardi"],
+                      description="Search for card on Star Wars Destiny DB and show its image")
+    async def card_image(self, ctx, *, terms):
+        channel = ctx.message.channel
+        if not self._admit(ctx.message, ["!" + terms]):
+            return
+
+        with self.bot.tracer.trace("card_image", query=terms) as trace, \
+                self._serving(ctx.message, ["!" + terms]):
+            try:
+                card = await self.bot.search.find_card(terms, trace)
+            except SearchBusy:
+                self._forget(ctx.message, ["!" + terms])
+                self.bot.dispatcher.enqueue(channel, SWCardSearch.BUSY_MESSAGE,
+                                            trace=trace)
+                return
+
+            if card:
+                with trace.span("render"):
+                    embed = self.bot.embed_cache.image(card)
+                self.bot.dispatcher.enqueue(channel, embed=embed, trace=trace)
+            else:
+                self.bot.dispatcher.enqueue(channel, "Card not found :(",
+                                            trace=trace)
+
+    @commands.command(pass_context=True, description="Show decklist from Star Wars Destiny DB")
+    async def deck(self, ctx, key: int):
+        """
+        The command for showing decklist summary.
+
+        Decklist is fetched once and its cards are resolved
+        against card catalog.
+
+        Format: <prefix>deck [decklist id]
+        Example: !deck 19504
+
+        :param int key: the decklist identifier
+        """
+        channel = ctx.message.channel
+        if not self._allow(ctx.message):
+            return
+
+        with self.bot.tracer.trace("deck", query=key) as trace:
+            try:
+                with trace.span("fetch"):
+                    decklist = await self.bot.decklists.get(key)
+            except CLIENT_ERRORS:
+                self.bot.dispatcher.enqueue(channel, "Deck not found :(",
+                                            trace=trace)
+                return
+
+            codes = list(decklist.get("characters", {}))
+            codes.extend(decklist.get("slots", {}))
+            try:
+                with trace.span("catalog"):
+                    cards = await self.bot.search.find_cards_by_code(codes)
+            except CLIENT_ERRORS:
+                self.bot.dispatcher.enqueue(channel, "Cards not available :(",
+                                            trace=trace)
+                return
+            trace.attrs["candidates"] = len(codes)
+
+            with trace.span("render"):
+                deck = Deck(decklist, dict(zip(codes, cards)))
+                embed = DeckEmbed(deck).render()
+            self.bot.dispatcher.enqueue(channel, embed=embed, trace=trace)
 
     async def on_message(self, message):
         """
@@ -66,25 +154,163 @@ class SWCardSearch:
         if message.author.bot:
             return
 
-        queries = set(re.findall(SWCardSearch.PATTERN, message.content))
+        start = time.perf_counter()
+        queries = extract_mentions(message.content)
+        parsed = time.perf_counter() - start
+        if not queries:
+            return
+
+        queries = self._admit(message, queries)
+        if not queries:
+            return
+
+        terms = [query[1:] if query.startswith("!") else query
+                 for query in queries]
+        with self.bot.tracer.trace("mention", query=queries) as trace, \
+                self._serving(message, queries):
+            trace.add("parse", parsed)
+            try:
+                cards = await self.bot.search.find_cards(terms, trace)
+            except SearchBusy:
+                self._forget(message, queries)
+                self.bot.dispatcher.enqueue(message.channel,
+                                            SWCardSearch.BUSY_MESSAGE,
+                                            trace=trace)
+                return
+
+            with trace.span("render"):
+                replies = self._replies(queries, cards, message.server)
+            for content, embed in replies:
+                self.bot.dispatcher.enqueue(message.channel, content,
+                                            embed=embed, trace=trace)
+
+    def _allow(self, message):
+        """
+        Checks whether author of message is not throttled.
+
+        :param obj message: the message requesting lookup
+        :rtype: bool
+        """
+        if self.bot.throttle.allow(message.author.id):
+            return True
+        REQUESTS_SUPPRESSED.inc(reason="throttled")
+        return False
+
+    def _admit(self, message, queries):
+        """
+        Filters out lookups suppressed by dedup window or throttle.
+
+        Queries are compared normalized, image lookups (prefixed by "!")
+        separately from detail lookups. Throttle is checked only if any
+        query is not duplicate, so repeated lookups do not spend user's
+        rate.
+
+        :param obj message: the message requesting lookups
+        :param list queries: the requested queries
+        :return: the queries that should be searched
+        :rtype: list(str)
+        """
+        admitted = []
         for query in queries:
-            show_only_image = False
-            if query.startswith("!"):
-                query = query[1:]
-                show_only_image = True
+            if self.bot.dedup.seen(SWCardSearch._dedup_key(message, query)):
+                REQUESTS_SUPPRESSED.inc(reason="duplicate")
+            else:
+                admitted.append(query)
 
-            card = self.bot.search.find_card(query)
+        if admitted and not self._allow(message):
+            self._forget(message, admitted)
+            return []
+        return admitted
 
-            if card:
+    @contextmanager
+    def _serving(self, message, queries):
+        """
+        Forgets admitted lookups if serving them fails, e.g. when catalog
+        cannot be loaded, so retry is not suppressed by dedup window.
+
+        :param obj message: the message requesting lookups
+        :param list queries: the admitted queries
+        """
+        try:
+            yield
+        except Exception:
+            self._forget(message, queries)
+            raise
+
+    def _forget(self, message, queries):
+        """
+        Removes lookups that were not served from dedup window.
+
+        :param obj message: the message requesting lookups
+        :param list queries: the queries to forget
+        """
+        for query in queries:
+            self.bot.dedup.forget(SWCardSearch._dedup_key(message, query))
+
+    @staticmethod
+    def _dedup_key(message, query):
+        channel = getattr(message.channel, "id", message.channel)
+        show_only_image = query.startswith("!")
+        term = query[1:] if show_only_image else query
+        return channel, show_only_image, SearchIndex.normalize(term)
+
+    def _replies(self, queries, cards, server):
+        """
+        Coalesces results of mentions to as few messages as possible.
+
+        Discord allows single embed per message, so each found card
+        is sent in its own message, card found by several mentions
+        only once. Mentions without card are collapsed to single line,
+        sent with first message, their terms are escaped. Cards keep
+        order of their mentions.
+
+        :param list queries: the mentions in order of appearance
+        :param list cards: the card or None for each mention
+        :param obj server: the server mentions were sent to
+        :return: the content and embed of each message
+        :rtype: list(tuple)
+        """
+        embeds = OrderedDict()
+        misses = []
+        for query, card in zip(queries, cards):
+            show_only_image = query.startswith("!")
+
+            if not card:
+                misses.append(query[1:] if show_only_image else query)
+            elif (card.get("code"), show_only_image) not in embeds:
                 if show_only_image:
-                    embed = CardImage(card).render()
+                    embed = self.bot.embed_cache.image(card)
                 else:
-                    emojis = message.server.emojis
-                    embed = CardDetail(card, emojis).render()
-                await self.bot.send_message(message.channel, embed=embed)
+                    emojis = self.bot.emoji_cache.get(server)
+                    embed = self.bot.embed_cache.detail(card, emojis)
+                embeds[card.get("code"), show_only_image] = embed
+
+        replies = [[None, embed] for embed in embeds.values()]
+        if misses:
+            terms = ", ".join(f'"{SWCardSearch._escape(term)}"'
+                              for term in OrderedDict.fromkeys(misses))
+            summary = f"No card found for {terms}. :("
+            if replies:
+                replies[0][0] = summary
             else:
-                await self.bot.send_message(message.channel,
-                                            f"No card found. :(")
+                replies.append([summary, None])
+        return [tuple(reply) for reply in replies]
+
+    @staticmethod
+    def _escape(term):
+        """
+        Escapes user's term echoed in bot's message.
+
+        Zero-width space is inserted after `@` and `<`, so term cannot
+        ping @everyone, @here, users or roles with bot's permissions,
+        and markdown characters are escaped by backslash.
+
+        :param str term: the mentioned term
+        :return: the term safe to send
+        :rtype: str
+        """
+        escaped = MARKDOWN.sub(r"\\\1", term)
+        return escaped.replace("@", "@\u200b").replace("<", "<\u200b")
 
 
 def setup(bot):
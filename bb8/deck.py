@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides Star Wars Destiny decklists.
+
+Example:
+    This example shows summary of decklist::
+
+        $ decklists = Decklists(client)
+        $ decklist = await decklists.get(19504)
+        $ deck = Deck(decklist, cards)
+        $ deck.points
+"""
+from .search import ResultCache
+
+
+class Decklists:
+    """
+    Fetches decklists from SWDestinyDB and caches them.
+
+    :param obj db_client: the asynchronous client to get decklists from API.
+    :param obj cache: the cache of fetched decklists.
+                      (default: ResultCache(maxsize=128, ttl=3600))
+    """
+
+    def __init__(self, db_client, cache=None):
+        self.db_client = db_client
+        self.cache = cache or ResultCache(maxsize=128, ttl=3600,
+                                          name="decklists")
+
+    async def get(self, key):
+        """
+        Gets decklist with given identifier.
+
+        :param int key: the decklist identifier
+        :return: the decklist as returned by API
+        :rtype: dict
+        """
+        decklist = self.cache.get(key)
+        if decklist is ResultCache.MISSING:
+            decklist = await self.db_client.get_decklist(key)
+            self.cache.put(key, decklist)
+        return decklist
+
+
+class Deck:
+    """
+    Summary of decklist resolved against card catalog.
+
+    Cards missing in catalog, e.g. from set catalog has not picked up
+    yet, are listed by their codes in `unknown`. They are not included
+    in points nor in the number of draw deck cards, only their dice
+    are counted.
+
+    :param dict decklist: the decklist as returned by SWDestinyDB API.
+    :param dict cards: the mapping of card codes to cards.
+    """
+    URL = "https://swdestinydb.com/decklist/view/{}"
+
+    def __init__(self, decklist, cards):
+        self.name = decklist.get("name", "")
+        self.url = Deck.URL.format(decklist.get("id"))
+        self.characters = []
+        self.battlefields = []
+        self.plots = []
+        self.unknown = []
+        self.dice = 0
+        self.points = 0
+        self.cards = 0
+
+        slots = list(decklist.get("characters", {}).items())
+        slots.extend(decklist.get("slots", {}).items())
+        for code, slot in slots:
+            self._add(code, cards.get(code), slot)
+
+    def _add(self, code, card, slot):
+        """
+        Adds single slot of decklist to summary.
+
+        :param str code: the card code
+        :param card: the card or None if it is not in catalog
+        :param dict slot: the quantity and dice of card
+        """
+        quantity = slot.get("quantity", 1)
+        dice = slot.get("dice", 0)
+        self.dice += dice
+        count = f"{quantity}x " if quantity > 1 else ""
+
+        if card is None:
+            self.unknown.append(f"{count}{code}")
+            return
+
+        label = card["label"]
+        typ = card["type_code"]
+        if typ == "character":
+            elite = dice > quantity
+            self.points += quantity * self._points(card, elite)
+            prefix = "Elite " if elite else ""
+            self.characters.append(f"{count}{prefix}{label}")
+        elif typ == "battlefield":
+            self.battlefields.append(label)
+        elif typ == "plot":
+            self.points += self._points(card, False)
+            self.plots.append(label)
+        else:
+            self.cards += quantity
+
+    def _points(self, card, elite):
+        """
+        Gets points of card, e.g. 12/15 for character.
+
+        :return: the elite or regular points
+        :rtype: int
+        """
+        points = str(card.get("points") or 0).split("/")
+        try:
+            return int(points[-1] if elite else points[0])
+        except ValueError:
+            return 0
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Dispatch module.
+
+This module provides outbound queue of bot replies, that paces messages
+of each channel, so busy channel does not hit rate limits shared
+with other channels.
+
+Example:
+    Replies are enqueued and sent in background::
+
+        $ dispatcher = Dispatcher(bot.send_message, loop=bot.loop)
+        $ dispatcher.enqueue(channel, "No card found. :(")
+        $ dispatcher.enqueue(channel, embed=embed)
+
+    Trace of request is held until its reply is sent, so it includes
+    time reply waited in queue and time of sending it::
+
+        $ dispatcher.enqueue(channel, embed=embed, trace=trace)
+"""
+from .metrics import DISPATCH_DROPPED, DISPATCH_MERGED
+from .tracing import NULL_TRACE
+from collections import deque
+
+import asyncio
+import logging
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` messages per `per` seconds.
+
+    Bucket starts full, so bursts up to `rate` messages are sent
+    immediately.
+
+    :param int rate: the number of messages allowed in window.
+    :param float per: the window length in seconds.
+    :param func clock: the function returning current time in seconds.
+                       (default: time.monotonic)
+    """
+
+    def __init__(self, rate, per, clock=time.monotonic):
+        self.rate = rate
+        self.per = per
+        self.clock = clock
+        self.tokens = rate
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.rate, self.tokens +
+                          (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def delay(self):
+        """
+        Gets the number of seconds until message can be sent.
+
+        :rtype: float
+        """
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def take(self):
+        """
+        Takes token for one message.
+        """
+        self._refill()
+        self.tokens -= 1
+
+
+class Reply:
+    """
+    Reply waiting in channel queue.
+
+    :param obj destination: the channel reply is sent to.
+    :param str content: the message text.
+    :param obj embed: the message embed.
+    :param float created: the time reply was enqueued.
+    :param list traces: the traces of requests reply belongs to.
+    """
+    __slots__ = ("destination", "content", "embed", "created", "traces")
+
+    def __init__(self, destination, content, embed, created, traces):
+        self.destination = destination
+        self.content = content
+        self.embed = embed
+        self.created = created
+        self.traces = traces
+
+    def release(self, queued=None, sent=None):
+        """
+        Releases traces of reply, adding its stages if it was sent.
+
+        :param float queued: the seconds reply waited in queue.
+        :param float sent: the seconds sending reply took.
+        """
+        for trace in self.traces:
+            if queued is not None:
+                trace.add("queue", queued)
+                trace.add("send", sent)
+            trace.release()
+        self.traces = []
+
+
+class Dispatcher:
+    """
+    Sends replies through per-channel queues paced by token buckets.
+
+    Buckets mirror Discord's limit of 5 messages per 5 seconds
+    per channel. Each channel has its own worker, so waiting
+    for one channel's bucket never delays other channels.
+
+    Queue of each channel is bounded by `max_pending`. Text reply
+    following another text reply still waiting in queue is merged
+    into it. When queue is full, its oldest reply is dropped.
+    Replies waiting longer than `max_age` are dropped as stale.
+
+    Traces of enqueued replies are held until reply is sent or dropped.
+    Sent reply adds `queue` and `send` stages to its traces.
+
+    :param func send: the coroutine function sending message, e.g.
+                      discord.Client.send_message
+    :param int rate: the number of messages per window. (default: 5)
+    :param float per: the window length in seconds. (default: 5)
+    :param int max_pending: the maximum number of queued replies
+                            of channel. (default: 10)
+    :param float max_age: the number of seconds reply is valid.
+                          (default: 30)
+    :param obj loop: the event loop workers run in. (default: None)
+    :param func clock: the function returning current time in seconds.
+                       (default: time.monotonic)
+    """
+    # Maximum length of Discord message.
+    MAX_CONTENT = 2000
+
+    def __init__(self, send, rate=5, per=5, max_pending=10, max_age=30,
+                 loop=None, clock=time.monotonic):
+        self.send = send
+        self.rate = rate
+        self.per = per
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.loop = loop or asyncio.get_event_loop()
+        self.clock = clock
+        self.queues = {}
+        self.buckets = {}
+        self.workers = {}
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _key(destination):
+        return getattr(destination, "id", destination)
+
+    def enqueue(self, destination, content=None, *, embed=None,
+                trace=NULL_TRACE):
+        """
+        Enqueues reply to channel.
+
+        :param obj destination: the channel reply is sent to.
+        :param str content: the message text. (default: None)
+        :param obj embed: the message embed. (default: None)
+        :param obj trace: the trace of request reply belongs to.
+                          (default: NULL_TRACE)
+        """
+        key = Dispatcher._key(destination)
+        queue = self.queues.setdefault(key, deque())
+        trace.hold()
+
+        if embed is None and queue and self._merge(queue[-1], content):
+            queue[-1].traces.append(trace)
+            DISPATCH_MERGED.inc()
+        else:
+            if len(queue) >= self.max_pending:
+                queue.popleft().release()
+                DISPATCH_DROPPED.inc(reason="full")
+            queue.append(Reply(destination, content, embed, self.clock(),
+                               [trace]))
+
+        if key not in self.workers:
+            self.workers[key] = self.loop.create_task(self._work(key))
+
+    def _merge(self, pending, content):
+        if pending.embed is not None or content is None:
+            return False
+        merged = pending.content + "\n" + content
+        if len(merged) > Dispatcher.MAX_CONTENT:
+            return False
+        pending.content = merged
+        return True
+
+    async def _work(self, key):
+        """
+        Sends queued replies of channel until its queue is empty.
+        """
+        queue = self.queues[key]
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.per, self.clock)
+            self.buckets[key] = bucket
+
+        try:
+            while queue:
+                delay = bucket.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay, loop=self.loop)
+                    continue
+
+                reply = queue.popleft()
+                queued = self.clock() - reply.created
+                if queued > self.max_age:
+                    reply.release()
+                    DISPATCH_DROPPED.inc(reason="stale")
+                    continue
+
+                bucket.take()
+                start = time.perf_counter()
+                try:
+                    await self.send(reply.destination, reply.content,
+                                    embed=reply.embed)
+                except Exception:
+                    self.logger.exception(f"Failed to send reply to {key}")
+                finally:
+                    reply.release(queued, time.perf_counter() - start)
+        finally:
+            del self.workers[key]
+            if not queue:
+                del self.queues[key]
+
+    def pending(self):
+        """
+        Gets the number of queued replies.
+
+        :rtype: int
+        """
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def close(self):
+        """
+        Stops all workers, queued replies are discarded.
+        """
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.wait(workers, loop=self.loop)
+        for queue in self.queues.values():
+            for reply in queue:
+                reply.release()
+        self.queues.clear()
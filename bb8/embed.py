@@ -1,11 +1,144 @@
 """
 Provides different Discord embed renderings.
 """
+from .metrics import CACHE_LOOKUPS, RENDER_SECONDS
+from collections import OrderedDict
 from discord import Embed
+from discord.embeds import EmptyEmbed
 
+import copy
 import re
 
 
+class EmojiSubstitutions:
+    """
+    Emoji substitutions of card icons available in server.
+
+    Substitutions are resolved with single pass over server emojis.
+
+    :param list emojis: the list of available emojis
+    """
+
+    def __init__(self, emojis):
+        available = {}
+        for emoji in emojis:
+            available.setdefault(emoji.name, str(emoji))
+
+        self.text = self._build(CardDetail.TEXT_MAPPING, available)
+        self.side = self._build(CardDetail.SIDES_MAPPING, available)
+        # Servers with the same card emojis render cards the same way.
+        self.profile = (frozenset(self.text.items()),
+                        frozenset(self.side.items()))
+
+    def _build(self, mapping, available):
+        """
+        Builds emoji substitutions for given mapping.
+
+        :param dict mapping: the mapping of shortcuts to emoji names
+        :param dict available: the mapping of emoji names to emoji hashes
+        :return: the mapping of card icons to emoji hashes.
+        """
+        return {
+            pattern: available[name]
+            for pattern, name in mapping.items()
+            if name in available
+        }
+
+
+class EmojiCache:
+    """
+    Caches emoji substitutions of each server.
+
+    Server's substitutions must be invalidated when its emojis change.
+    """
+
+    def __init__(self):
+        self.servers = {}
+
+    def get(self, server):
+        """
+        Gets emoji substitutions of server.
+
+        :param obj server: the server message was sent to
+        :return: the substitutions of server emojis
+        :rtype: EmojiSubstitutions
+        """
+        substitutions = self.servers.get(server.id)
+        if substitutions is None:
+            CACHE_LOOKUPS.inc(cache="emojis", result="miss")
+            substitutions = EmojiSubstitutions(server.emojis)
+            self.servers[server.id] = substitutions
+        else:
+            CACHE_LOOKUPS.inc(cache="emojis", result="hit")
+        return substitutions
+
+    def invalidate(self, server):
+        """
+        Removes cached substitutions of server.
+
+        :param obj server: the server which emojis changed
+        """
+        self.servers.pop(server.id, None)
+
+
+class EmbedCache:
+    """
+    Bounded cache of rendered card embeds.
+
+    Detail embeds are cached by card code and server's emoji profile,
+    image embeds only by card code. Cached embed is used only for
+    the same card it was rendered from, so embeds of cards changed
+    by catalog refresh are rendered again. Each caller gets its own copy
+    of cached embed, so cached embeds cannot be modified.
+
+    :param int maxsize: the maximum number of cached embeds. (default: 512)
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def detail(self, card, emojis):
+        """
+        Gets card detail embed.
+
+        :param card: the card which embed should be rendered for.
+        :param obj emojis: the emoji substitutions of server.
+        :rtype: discord.Embed
+        """
+        key = ("detail", card.get("code"), emojis.profile)
+        return self._get(key, card, lambda: CardDetail(card, emojis).render())
+
+    def image(self, card):
+        """
+        Gets card image embed.
+
+        :param card: the card which embed should be rendered for.
+        :rtype: discord.Embed
+        """
+        key = ("image", card.get("code"))
+        return self._get(key, card, lambda: CardImage(card).render())
+
+    def _get(self, key, card, render):
+        if key[1] is None:
+            return render()
+
+        entry = self.entries.get(key)
+        if entry is None or not (entry[0] is card or entry[0] == card):
+            CACHE_LOOKUPS.inc(cache="embeds", result="miss")
+            embed = render()
+            self.entries[key] = (card, embed)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            CACHE_LOOKUPS.inc(cache="embeds", result="hit")
+            embed = entry[1]
+            self.entries.move_to_end(key)
+
+        return copy.deepcopy(embed, {id(EmptyEmbed): EmptyEmbed})
+
+
 class CardEmbed:
     """
     Provides base for all card embeds.
@@ -47,23 +180,37 @@ class CardImage(CardEmbed):
         """
         Renders card image as Discord Embed.
         """
-        self.embed.set_image(url=self.card["imagesrc"])
+        with RENDER_SECONDS.time(embed="image"):
+            self.embed.set_image(url=self.card["imagesrc"])
         return self.embed
 
 
 class CardDetail(CardEmbed):
     """
     Renders embed with card details.
+
+    :param card: the card which embed should be rendered for.
+    :param emojis: the list of available emojis or their
+                   cached substitutions (EmojiSubstitutions)
     """
 
     TEXT_MAPPING = {
-        "\[special\]": "swspecial",
-        "\[blank\]": "swblank",
-        "\[melee\]": "swmelee",
-        "\[ranged\]": "swranged",
-        "\[indirect\]": "swindirect"
+        "special": "swspecial",
+        "blank": "swblank",
+        "melee": "swmelee",
+        "ranged": "swranged",
+        "indirect": "swindirect"
     }
 
+    MARKUP_MAPPING = {
+        "b": "**",
+        "em": "*",
+        "i": "*"
+    }
+
+    # Matches [icon] shortcuts and markup tags in card text.
+    TEXT_PATTERN = re.compile(r"\[(\w+)\]|</?(b|em|i)>")
+
     SIDES_MAPPING = {
         "RD": "swranged",
         "MD": "swmelee",
@@ -81,10 +228,10 @@ class CardDetail(CardEmbed):
 
     def __init__(self, card, emojis):
         super().__init__(card)
-        self.text_subs = self._build_substitutions(CardDetail.TEXT_MAPPING,
-                                                   emojis)
-        self.side_subs = self._build_substitutions(CardDetail.SIDES_MAPPING,
-                                                   emojis)
+        if not isinstance(emojis, EmojiSubstitutions):
+            emojis = EmojiSubstitutions(emojis)
+        self.text_subs = emojis.text
+        self.side_subs = emojis.side
 
     def type_line(self):
         """
@@ -131,11 +278,7 @@ class CardDetail(CardEmbed):
         :rtype: str
         """
         result = self.card["text"] if "text" in self.card else "(no text)"
-        for target, sub in self.text_subs.items():
-            result = re.sub(target, sub, result)
-        result = re.sub(r"<b>(.+)</b>", r"**\1**", result)
-        result = re.sub(r"<em>(.+)</em>", r"*\1*", result)
-        result = re.sub(r"<i>(.+)</i>", r"*\1*", result)
+        result = CardDetail.TEXT_PATTERN.sub(self._text_substitution, result)
 
         if "sides" in self.card:
             dice_line = self._dice_line(self.card["sides"])
@@ -143,6 +286,21 @@ class CardDetail(CardEmbed):
 
         return result
 
+    def _text_substitution(self, match):
+        """
+        Substitutes single icon shortcut or markup tag.
+
+        Icons without available emoji are kept as they are.
+
+        :param obj match: the match of TEXT_PATTERN
+        :return: the emoji or markdown
+        :rtype: str
+        """
+        icon, tag = match.groups()
+        if tag:
+            return CardDetail.MARKUP_MAPPING[tag]
+        return self.text_subs.get(icon, match.group(0))
+
     def _dice_line(self, sides):
         """
         Constructs dice side line by substituting icons with emojis.
@@ -166,52 +324,20 @@ class CardDetail(CardEmbed):
         if match:
             value, icon, extra_cost = match.groups()
 
-            for pattern, emoji in self.side_subs.items():
-                if re.match(pattern, icon):
-                    icon = emoji
-                    break
-
-            line = icon
+            line = self.side_subs.get(icon, icon)
             if value and value == '0':
                 line = f"X {line}"
             elif value:
                 line = f"{value} {line}"
 
             if extra_cost:
-                resource = self.side_subs["R"]
+                resource = self.side_subs.get("R", "R")
                 line = f"{line} / {extra_cost} {resource}"
 
             return line
 
         return None
 
-    def _build_substitutions(self, mapping, emojis):
-        """
-        Builds emoji substitutions for given mapping.
-
-        :param dict mapping: the mapping of shortcuts to emoji names
-        :param list emojis: the list of available emojis
-        :return: the mapping of card icons to emoji hashes.
-        """
-        return {
-            pattern: self._find_emoji(name, emojis)
-            for pattern, name in mapping.items()
-            if self._find_emoji(name, emojis)
-        }
-
-    def _find_emoji(self, name, emojis):
-        """
-        Gets emoji hash for emoji with given name.
-
-        :param str name: the emoji name, e.g. swspecial
-        :param list emojis: the list of available emojis
-        :return: the emoji hash or None if emoji with given name does not exists
-        """
-        for emoji in emojis:
-            if emoji.name == name:
-                return str(emoji)
-        return None
-
     def footer_line(self):
         """
         Constructs footer line containing illustrator,
@@ -239,11 +365,60 @@ class CardDetail(CardEmbed):
 
         :return: the rendered embed
         """
+        with RENDER_SECONDS.time(embed="detail"):
+            self.embed.add_field(
+                name=self.type_line(),
+                value=self.text_line()
+            )
+            self.embed.set_footer(text=self.footer_line())
+            self.embed.set_thumbnail(url=self.card["imagesrc"])
+
+        return self.embed
+
+
+class DeckEmbed:
+    """
+    Renders embed with decklist summary.
+
+    :param deck: the deck summary which embed should be rendered for.
+    """
+
+    def __init__(self, deck):
+        self.deck = deck
+        self.embed = Embed(
+            type="rich",
+            title=deck.name,
+            url=deck.url
+        )
+
+    def render(self):
+        """
+        Renders deck summary as Discord Embed.
+
+        Example:
+
+            Characters: Elite Rey, 2x Rebel Trooper
+            Battlefield: Echo Base • Points: 30 • Dice: 12 • Cards: 30
+
+        :return: the rendered embed
+        """
+        deck = self.deck
         self.embed.add_field(
-            name=self.type_line(),
-            value=self.text_line()
+            name="Characters",
+            value="\n".join(deck.characters) or "-",
+            inline=False
         )
-        self.embed.set_footer(text=self.footer_line())
-        self.embed.set_thumbnail(url=self.card["imagesrc"])
+        if deck.battlefields:
+            self.embed.add_field(name="Battlefield",
+                                 value="\n".join(deck.battlefields))
+        if deck.plots:
+            self.embed.add_field(name="Plot", value="\n".join(deck.plots))
+        self.embed.add_field(name="Points", value=str(deck.points))
+        self.embed.add_field(name="Dice", value=str(deck.dice))
+        self.embed.add_field(name="Cards", value=str(deck.cards))
+        if deck.unknown:
+            self.embed.add_field(name="Unknown cards",
+                                 value="\n".join(deck.unknown),
+                                 inline=False)
 
         return self.embed
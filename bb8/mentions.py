@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Mentions module.
+
+This module extracts card mentions in format [[term]] from messages.
+
+Example:
+    Mentions are extracted in order of appearance, without duplicates::
+
+        $ extract_mentions("[[Rey]] and [[!Phasma]], [[Rey]]")
+        ['Rey', '!Phasma']
+"""
+from collections import OrderedDict
+
+import re
+
+# Maximum number of mentions searched in single message.
+MAX_MENTIONS = 10
+# Maximum length of mentioned term.
+MAX_LENGTH = 64
+# Mention with term, terms cannot contain brackets or span multiple lines.
+PATTERN = re.compile(r"\[\[([^\[\]\n]{1,%d})\]\]" % MAX_LENGTH)
+
+
+def extract_mentions(content, max_mentions=MAX_MENTIONS):
+    """
+    Extracts card mentions from message.
+
+    Messages without `[[` are skipped without running regex. Terms longer
+    than MAX_LENGTH are ignored and extraction stops after
+    `max_mentions` distinct mentions, so large messages cannot trigger
+    expensive searches.
+
+    :param str content: the message text
+    :param int max_mentions: the maximum number of extracted mentions.
+                             (default: MAX_MENTIONS)
+    :return: the distinct mentions in order of appearance
+    :rtype: list(str)
+    """
+    if "[[" not in content:
+        return []
+
+    mentions = OrderedDict()
+    for match in PATTERN.finditer(content):
+        mention = match.group(1).strip()
+        if mention and mention != "!":
+            mentions[mention] = None
+            if len(mentions) >= max_mentions:
+                break
+    return list(mentions)
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""Metrics module.
+
+This module provides counters and latency histograms of bot operations,
+exported in Prometheus text format.
+
+Example:
+    Metrics are registered once and updated where operation happens::
+
+        $ requests = REGISTRY.counter("requests_total", "Requests", ["status"])
+        $ requests.inc(status="200")
+
+        $ latency = REGISTRY.histogram("request_seconds", "Request latency")
+        $ with latency.time():
+        $     send_request()
+
+    Registry is exported on local HTTP port::
+
+        $ server = MetricsServer(REGISTRY, port=9100)
+        $ await server.start()
+"""
+from aiohttp import web
+from bisect import bisect_left
+from collections import OrderedDict
+
+import threading
+import time
+
+# Default latency buckets in seconds, from 1 ms to 10 s.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", r"\\")
+                         .replace('"', r'\"').replace("\n", r"\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Provides base for all metrics.
+
+    Metric holds one series for each combination of label values.
+    Updates are thread-safe, so metrics can be updated from executors.
+
+    :param str name: the metric name
+    :param str documentation: the help text of metric
+    :param list labels: the label names of metric. (default: ())
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError("Expected labels {} of metric {}, got {}".format(
+                self.labels, self.name, tuple(labels)
+            ))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        """
+        Renders metric in Prometheus text format.
+
+        :return: the lines of metric
+        :rtype: list(str)
+        """
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.TYPE)
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+        for key, value in series:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Counts events, e.g. requests or cache hits.
+    """
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments counter.
+
+        :param int amount: the increment. (default: 1)
+        :param labels: the label values of series
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels):
+        """
+        Gets current value of series.
+
+        :param labels: the label values of series
+        """
+        return self.series.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        return ["{}{} {}".format(
+            self.name, _format_labels(self.labels, key), _format_value(value)
+        )]
+
+
+class Histogram(Metric):
+    """
+    Samples durations into cumulative buckets.
+
+    :param list buckets: the upper bounds of buckets in seconds.
+                         (default: DEFAULT_BUCKETS)
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=None):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+
+    def observe(self, value, **labels):
+        """
+        Records one observation.
+
+        :param float value: the observed value, e.g. duration in seconds
+        :param labels: the label values of series
+        """
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0, 0]
+            position = bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                series[0][position] += 1
+            series[1] += 1
+            series[2] += value
+
+    def time(self, **labels):
+        """
+        Measures duration of `with` block.
+
+        :param labels: the label values of series
+        :rtype: Timer
+        """
+        return Timer(self, labels)
+
+    def count(self, **labels):
+        """
+        Gets the number of observations of series.
+
+        :param labels: the label values of series
+        """
+        series = self.series.get(self._key(labels))
+        return series[1] if series else 0
+
+    def _samples(self, key, value):
+        counts, count, total = value
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            le = [("le", _format_value(bound))]
+            lines.append("{}_bucket{} {}".format(
+                self.name, _format_labels(self.labels, key, le), cumulative
+            ))
+        lines.append("{}_bucket{} {}".format(
+            self.name,
+            _format_labels(self.labels, key, [("le", "+Inf")]),
+            count
+        ))
+        labels = _format_labels(self.labels, key)
+        lines.append("{}_count{} {}".format(self.name, labels, count))
+        lines.append("{}_sum{} {}".format(self.name, labels,
+                                          _format_value(total)))
+        return lines
+
+
+class Timer:
+    """
+    Context manager observing duration of its block in histogram.
+
+    :param obj histogram: the histogram duration is observed in.
+    :param dict labels: the label values of series
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start,
+                               **self.labels)
+
+
+class Registry:
+    """
+    Collection of metrics exported together.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Registers counter.
+
+        :param str name: the metric name
+        :param str documentation: the help text of metric
+        :param list labels: the label names of metric. (default: ())
+        :rtype: Counter
+        """
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=None):
+        """
+        Registers histogram.
+
+        :param str name: the metric name
+        :param str documentation: the help text of metric
+        :param list labels: the label names of metric. (default: ())
+        :param list buckets: the upper bounds of buckets.
+                             (default: DEFAULT_BUCKETS)
+        :rtype: Histogram
+        """
+        return self._register(
+            Histogram(name, documentation, labels, buckets)
+        )
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(
+                "Metric {} is already registered".format(metric.name)
+            )
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Renders all metrics in Prometheus text format.
+
+        :rtype: str
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Exports metrics registry over HTTP at /metrics.
+
+    Server binds to local interface only by default.
+
+    :param obj registry: the exported registry. (default: REGISTRY)
+    :param str host: the interface server listens on.
+                     (default: 127.0.0.1)
+    :param int port: the port server listens on. (default: 9100)
+    :param obj loop: the event loop server runs in. (default: None)
+    """
+
+    def __init__(self, registry=None, host="127.0.0.1", port=9100,
+                 loop=None):
+        self.registry = registry or REGISTRY
+        self.host = host
+        self.port = port
+        self.loop = loop
+        self.app = None
+        self.handler = None
+        self.server = None
+
+    async def _metrics(self, request):
+        return web.Response(
+            text=self.registry.render(),
+            content_type="text/plain",
+            charset="utf-8"
+        )
+
+    async def start(self):
+        """
+        Starts listening for requests.
+        """
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_route("GET", "/metrics", self._metrics)
+        self.handler = self.app.make_handler()
+        loop = self.app.loop
+        self.server = await loop.create_server(self.handler, self.host,
+                                               self.port)
+
+    async def stop(self):
+        """
+        Stops server and closes open connections.
+        """
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        await self.app.shutdown()
+        await self.handler.finish_connections(1.0)
+        await self.app.cleanup()
+        self.server = None
+
+
+# Registry of all bot metrics.
+REGISTRY = Registry()
+
+SEARCH_SECONDS = REGISTRY.histogram(
+    "bb8_search_seconds", "Latency of card searches"
+)
+SEARCH_QUERIES = REGISTRY.counter(
+    "bb8_search_queries_total", "Number of searched card labels"
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "bb8_http_request_seconds",
+    "Latency of SWDestinyDB API requests, including retries"
+)
+HTTP_RESPONSES = REGISTRY.counter(
+    "bb8_http_responses_total",
+    "Number of SWDestinyDB API attempts by response status",
+    ["status"]
+)
+HTTP_COALESCED = REGISTRY.counter(
+    "bb8_http_coalesced_total",
+    "Number of API requests served by identical in-flight request"
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "bb8_cache_lookups_total", "Number of cache lookups",
+    ["cache", "result"]
+)
+RENDER_SECONDS = REGISTRY.histogram(
+    "bb8_render_seconds", "Latency of embed rendering", ["embed"]
+)
+DISCORD_SEND_SECONDS = REGISTRY.histogram(
+    "bb8_discord_send_seconds", "Latency of sending Discord messages"
+)
+DISCORD_SEND_ERRORS = REGISTRY.counter(
+    "bb8_discord_send_errors_total", "Number of failed Discord messages"
+)
+DISPATCH_DROPPED = REGISTRY.counter(
+    "bb8_dispatch_dropped_total", "Number of dropped replies", ["reason"]
+)
+DISPATCH_MERGED = REGISTRY.counter(
+    "bb8_dispatch_merged_total", "Number of replies merged into queued reply"
+)
+REQUESTS_SUPPRESSED = REGISTRY.counter(
+    "bb8_requests_suppressed_total",
+    "Number of lookups suppressed as duplicate or throttled", ["reason"]
+)
@@ -6,25 +6,662 @@ Example:
     This example shows simple fuzzy search::
 
         $ search = Search()
-        $ search.find_card("captain phasma")
+        $ await search.find_card("captain phasma")
 """
 
-from bb8.swdestinydb import SWDestinyDBClient
-from fuzzywuzzy import process, fuzz
+from bb8.metrics import CACHE_LOOKUPS, SEARCH_QUERIES, SEARCH_SECONDS
+from bb8.swdestinydb import CardCatalog
+from bb8.tracing import NULL_TRACE
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor
+from fuzzywuzzy import fuzz, utils
+from operator import itemgetter
+
+import asyncio
+import copy
+import heapq
+import threading
+import time
+
+
+def edit_distance(a, b):
+    """
+    Gets Levenshtein distance of two words.
+
+    :param str a: the first word
+    :param str b: the second word
+    :return: the number of inserts, deletes and substitutions
+             turning one word to another
+    :rtype: int
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of words for lookup by edit distance.
+
+    Children of each node are keyed by their distance from node,
+    so lookup visits only subtrees that can contain close words.
+
+    Tree derived by :meth:`copy` shares nodes with original tree
+    and copies only nodes on paths of words added to it, so original
+    tree is never modified.
+
+    :param list words: the words to add. (default: ())
+    """
+
+    def __init__(self, words=()):
+        self.root = None
+        self.owned = None
+        for word in words:
+            self.add(word)
+
+    def copy(self):
+        """
+        Derives tree sharing nodes with this tree.
+
+        :rtype: BKTree
+        """
+        tree = BKTree()
+        tree.root = self.root
+        tree.owned = set()
+        return tree
+
+    def _node(self, word, children):
+        node = (word, children)
+        if self.owned is not None:
+            self.owned.add(id(node))
+        return node
+
+    def _own(self, node):
+        if self.owned is None or id(node) in self.owned:
+            return node
+        return self._node(node[0], dict(node[1]))
+
+    def add(self, word):
+        """
+        Adds word to tree.
+
+        :param str word: the word to add
+        """
+        if self.root is None:
+            self.root = self._node(word, {})
+            return
+
+        self.root = node = self._own(self.root)
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = self._node(word, {})
+                return
+            child = node[1][distance] = self._own(child)
+            node = child
+
+    def find(self, word, limit):
+        """
+        Finds words within given distance.
+
+        :param str word: the looked up word
+        :param int limit: the maximum distance of found words
+        :return: the found words
+        :rtype: list(str)
+        """
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= limit:
+                found.append(node_word)
+            for key in range(distance - limit, distance + limit + 1):
+                child = children.get(key)
+                if child is not None:
+                    nodes.append(child)
+        return found
+
+
+class SearchIndex:
+    """
+    Index of card labels prepared for fuzzy scoring.
+
+    Labels are normalized once, when index is built, so searching only
+    scores query against prepared labels. Index is never modified,
+    new index is built when catalog changes. Index of slightly changed
+    catalog can be derived from previous one by :meth:`patch`.
+
+    Index also maps character trigrams to labels containing them.
+    Query is scored only against shortlist of labels sharing most trigrams
+    with it. If none of them scores at least `STRONG_SCORE`, labels
+    containing words within small edit distance of query words are found
+    in BK-tree and scored as well, so typos do not need full scan.
+    If best of them scores at least `TYPO_SCORE`, it is the result,
+    otherwise all labels are scored.
+
+    :param list cards: the cards to be indexed.
+    """
+    # Length of character n-grams used for prefiltering.
+    GRAM_SIZE = 3
+    # Maximum number of labels scored before falling back to full scan.
+    SHORTLIST_SIZE = 32
+    # Minimum shortlist score that does not require full scan.
+    STRONG_SCORE = 90
+    # Minimum score of typo candidates that does not require full scan.
+    TYPO_SCORE = 75
+    # Minimum length of words looked up by edit distance.
+    WORD_SIZE = 4
+
+    def __init__(self, cards):
+        self.cards = cards
+        self.by_label = {}
+        self.by_code = {}
+        self.positions = {}
+        self.labels = []
+        self.choices = []
+        self.grams = {}
+        self.words = {}
+        self.tree = BKTree()
+        self.removed = 0
+        for card in cards:
+            self._add(card)
+
+    def patch(self, cards, removed, added):
+        """
+        Derives index of changed catalog from this index.
+
+        Only added labels are normalized and indexed, removed labels
+        are left as gaps. Label of removed card still used by other card,
+        e.g. reprint in another set, keeps its position and resolves
+        to that card. Index is rebuilt from scratch once more than
+        half of its labels were removed. This index is not modified.
+
+        :param list cards: all cards of changed catalog
+        :param list removed: the cards removed from catalog
+        :param list added: the cards added to catalog
+        :return: the index of changed catalog
+        :rtype: SearchIndex
+        """
+        index = copy.copy(self)
+        index.cards = cards
+        index.by_label = dict(self.by_label)
+        index.by_code = dict(self.by_code)
+        index.positions = dict(self.positions)
+        index.labels = list(self.labels)
+        index.choices = list(self.choices)
+        index.grams = dict(self.grams)
+        index.words = dict(self.words)
+        index.tree = self.tree.copy()
+
+        orphaned = set()
+        for card in removed:
+            if index.by_code.get(card.get("code")) is card:
+                del index.by_code[card["code"]]
+            if index.by_label.get(card["label"]) is card:
+                orphaned.add(card["label"])
+
+        if orphaned:
+            index._remove_labels(cards, orphaned)
+
+        owned = set()
+        for card in added:
+            index._add(card, owned)
+
+        if index.removed * 2 > len(index.labels):
+            return SearchIndex(cards)
+        return index
+
+    def _remove_labels(self, cards, labels):
+        """
+        Removes labels no card of catalog uses anymore, leaving gaps.
+
+        Label still used by other card is kept and resolves to last
+        such card, as in index built from scratch.
+
+        :param list cards: all cards of changed catalog
+        :param set labels: the labels of removed cards
+        """
+        survivors = {}
+        for card in cards:
+            if card["label"] in labels:
+                survivors[card["label"]] = card
+
+        for label in labels:
+            if label in survivors:
+                self.by_label[label] = survivors[label]
+                continue
+            del self.by_label[label]
+            position = self.positions.pop(label)
+            self.labels[position] = None
+            self.choices[position] = None
+            self.removed += 1
+
+    def _add(self, card, owned=None):
+        """
+        Adds card to index, last card with the same label wins.
+
+        :param obj card: the card to add
+        :param set owned: the trigrams whose postings were already copied
+                          from previous index (default: None, all postings
+                          belong to this index)
+        """
+        if "code" in card:
+            self.by_code[card["code"]] = card
+
+        label = card["label"]
+        self.by_label[label] = card
+        if label in self.positions:
+            return
+
+        position = len(self.labels)
+        choice = SearchIndex.normalize(label)
+        self.positions[label] = position
+        self.labels.append(label)
+        self.choices.append(choice)
+        for gram in SearchIndex.ngrams(choice):
+            postings = self.grams.get(gram)
+            if postings is None:
+                postings = self.grams[gram] = []
+                if owned is not None:
+                    owned.add(gram)
+            elif owned is not None and gram not in owned:
+                postings = self.grams[gram] = list(postings)
+                owned.add(gram)
+            postings.append(position)
+        for word in SearchIndex.words_of(choice):
+            if word not in self.words:
+                self.tree.add(word)
+            self.words[word] = self.words.get(word, ()) + (position,)
+
+    @staticmethod
+    def normalize(text):
+        """
+        Normalizes text the same way labels are normalized.
+
+        :param str text: the text to normalize
+        :return: the lowercase text without punctuation
+        :rtype: str
+        """
+        return utils.full_process(text)
+
+    @staticmethod
+    def ngrams(text):
+        """
+        Gets distinct character n-grams of text.
+
+        :param str text: the normalized text
+        :return: the n-grams of text
+        :rtype: set
+        """
+        size = SearchIndex.GRAM_SIZE
+        return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+    @staticmethod
+    def words_of(text):
+        """
+        Gets distinct words of text long enough for typo lookup.
+
+        :param str text: the normalized text
+        :rtype: set
+        """
+        return {word for word in text.split()
+                if len(word) >= SearchIndex.WORD_SIZE}
+
+    def best_match(self, text):
+        """
+        Finds card with label closest to given text.
+
+        :param str text: the partial label of card.
+        :return: the closest card and its score (0-100)
+                 or (None, 0) if index is empty
+        :rtype: tuple
+        """
+        results, _ = self.best_matches([text])
+        return results[0]
+
+    def best_matches(self, texts):
+        """
+        Finds cards with labels closest to each of given texts.
+
+        Queries without strong shortlist match are scored together
+        in single pass over all labels.
+
+        :param list texts: the partial labels of cards.
+        :return: the closest card and its score for each text and
+                 the number of distinct labels scored
+        :rtype: tuple(list(tuple), int)
+        """
+        queries = [SearchIndex.normalize(text) for text in texts]
+        results = [None] * len(queries)
+        scored = set()
+        weak = []
+        for i, query in enumerate(queries):
+            shortlist = self.shortlist(query)
+            best, score = self._best_of(query, shortlist, scored)
+            if score >= SearchIndex.STRONG_SCORE:
+                results[i] = (self._card(best), score)
+                continue
+
+            best, score = self._typo_match(query, shortlist, scored,
+                                           best, score)
+            if score >= SearchIndex.TYPO_SCORE:
+                results[i] = (self._card(best), score)
+            else:
+                weak.append(i)
+
+        if weak:
+            best = {i: (None, 0) for i in weak}
+            for position, choice in enumerate(self.choices):
+                if choice is None:
+                    continue
+                for i in weak:
+                    score = fuzz.partial_ratio(queries[i], choice)
+                    if best[i][0] is None or score > best[i][1]:
+                        best[i] = (position, score)
+            for i, (position, score) in best.items():
+                results[i] = (self._card(position), score)
+            return results, len(self.labels) - self.removed
+
+        return results, len(scored)
+
+    def shortlist(self, query):
+        """
+        Gets positions of labels sharing most trigrams with query.
+
+        :param str query: the normalized query
+        :return: the label positions in index order
+        :rtype: list(int)
+        """
+        shared = Counter()
+        for gram in SearchIndex.ngrams(query):
+            shared.update(self.grams.get(gram, ()))
+
+        if self.removed:
+            for position in [position for position in shared
+                             if self.choices[position] is None]:
+                del shared[position]
+
+        best = heapq.nlargest(SearchIndex.SHORTLIST_SIZE, shared.items(),
+                              key=itemgetter(1))
+        return sorted(position for position, _ in best)
+
+    def typo_candidates(self, query):
+        """
+        Gets positions of labels containing words close to query words.
+
+        Words up to 5 characters can differ by one edit, longer words
+        by two edits.
+
+        :param str query: the normalized query
+        :return: the label positions
+        :rtype: set
+        """
+        positions = set()
+        for word in SearchIndex.words_of(query):
+            limit = 1 if len(word) <= 5 else 2
+            for match in self.tree.find(word, limit):
+                positions.update(self.words.get(match, ()))
+        return positions
+
+    def _typo_match(self, query, shortlist, scored, best, best_score):
+        """
+        Scores typo candidates of query not already in shortlist.
+
+        :return: the position and score of best label so far
+        :rtype: tuple
+        """
+        typos = self.typo_candidates(query)
+        if not typos:
+            return best, 0
+        return self._best_of(query, sorted(typos.difference(shortlist)),
+                             scored, best, best_score)
+
+    def _best_of(self, query, positions, scored, best=None, best_score=0):
+        for position in positions:
+            choice = self.choices[position]
+            if choice is None:
+                continue
+            scored.add(position)
+            score = fuzz.partial_ratio(query, choice)
+            if best is None or score > best_score:
+                best, best_score = position, score
+        return best, best_score
+
+    def _card(self, position):
+        if position is None:
+            return None
+        return self.by_label[self.labels[position]]
+
+
+class SearchBusy(Exception):
+    """The exception thrown if search executor cannot accept more work."""
+    pass
+
+
+class BoundedExecutor(Executor):
+    """
+    Executor limiting number of pending tasks.
+
+    Task submitted while `max_pending` tasks are pending or running
+    is rejected with :class:`SearchBusy`, so bursts cannot queue
+    unbounded amount of work.
+
+    :param obj executor: the executor running tasks,
+                         e.g. ThreadPoolExecutor
+    :param int max_pending: the maximum number of pending tasks.
+    """
+
+    def __init__(self, executor, max_pending):
+        self.executor = executor
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.slots.acquire(blocking=False):
+            raise SearchBusy("Too many pending searches.")
+
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class ResultCache:
+    """
+    Bounded cache of search results.
+
+    Least recently used result is evicted when cache is full and results
+    older than `ttl` are never returned. Cache counts hits and misses,
+    so its efficiency can be reported.
+
+    :param int maxsize: the maximum number of cached results.
+                        (default: 1024)
+    :param int ttl: the number of seconds result is valid. (default: 600)
+    :param func clock: the function returning current time in seconds.
+                       (default: time.monotonic)
+    :param str name: the cache name reported in metrics. (default: search)
+    """
+    # Marker returned for results missing in cache, None is valid result.
+    MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=600, clock=time.monotonic,
+                 name="search"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.name = name
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Gets cached result.
+
+        :param str key: the normalized query
+        :return: the cached result or ResultCache.MISSING
+        """
+        entry = self.entries.get(key)
+        if entry is None or self.clock() - entry[1] >= self.ttl:
+            self.entries.pop(key, None)
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            return ResultCache.MISSING
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return entry[0]
+
+    def put(self, key, value):
+        """
+        Caches result, evicting least recently used one if cache is full.
+
+        :param str key: the normalized query
+        :param value: the result, can be None
+        """
+        self.entries[key] = (value, self.clock())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all cached results, counters are kept.
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Gets cache statistics.
+
+        :return: the number of hits, misses and cached results
+        :rtype: dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries)
+        }
 
 
 class Search:
     """
     Searches for Star Wars Destiny cards based on their label.
 
-    :param obj db_client: The client to get cards from datastore.
-                          (default: SWDestinyDBClient)
+    Searches read index built from catalog snapshot, catalog is loaded
+    on first search and then only when :meth:`refresh` is called.
+    Results are cached by normalized query until catalog changes.
+    Scoring runs in `executor` if it is set, so it does not block event loop.
+
+    :param obj db_client: The asynchronous client to get cards
+                          from datastore. (default: CardCatalog)
+    :param obj results: The cache of search results.
+                        (default: ResultCache())
+    :param obj executor: The executor running CPU heavy work.
+                         (default: None, work runs in event loop)
     """
 
-    def __init__(self, db_client=None):
-        self.db_client = db_client or SWDestinyDBClient()
+    def __init__(self, db_client=None, results=None, executor=None):
+        self.db_client = db_client or CardCatalog()
+        self.results = results or ResultCache()
+        self.executor = executor
+        self.index = None
+
+    async def _run(self, func, *args):
+        """
+        Runs function in search executor.
+
+        :raises SearchBusy: if executor cannot accept more work
+        """
+        if self.executor is None:
+            return func(*args)
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def refresh(self, revalidate=False):
+        """
+        Refreshes catalog and swaps in new index if catalog changed.
+
+        Index is built in default executor, so it neither blocks event loop
+        nor competes with searches. New index is swapped in by single
+        assignment, so searches always read complete index. If refresh
+        fails, previous index is kept.
+
+        :param bool revalidate: whether catalog is revalidated even if
+                                it is still fresh. (default: False)
+        :return: the index of current catalog
+        :rtype: SearchIndex
+        """
+        if revalidate:
+            await self.db_client.refresh()
+        cards = await self.db_client.get_cards()
+        index = self.index
+        if index is None or index.cards is not cards:
+            loop = asyncio.get_event_loop()
+            index = await loop.run_in_executor(None, SearchIndex, cards)
+            self.index = index
+            self.results.clear()
+        return index
+
+    async def refresh_sets(self):
+        """
+        Refreshes only changed sets of catalog and patches index.
+
+        Index is patched in default executor and swapped in the same way
+        as by :meth:`refresh`. If index was not built from catalog
+        refreshed sets were applied to, it is rebuilt instead.
+
+        :return: the index of current catalog
+        :rtype: SearchIndex
+        """
+        change = await self.db_client.refresh_sets()
+        index = self.index
+        if index is not None and index.cards is change.cards:
+            return index
+
+        loop = asyncio.get_event_loop()
+        if index is None or index.cards is not change.previous:
+            index = await loop.run_in_executor(None, SearchIndex,
+                                               change.cards)
+        else:
+            index = await loop.run_in_executor(None, index.patch,
+                                               change.cards, change.removed,
+                                               change.added)
+        self.index = index
+        self.results.clear()
+        return index
 
-    def find_card(self, text):
+    async def find_cards_by_code(self, codes):
+        """
+        Finds cards with given codes in current catalog.
+
+        :param list codes: the card codes, e.g. 01001
+        :return: the card or None for each code, in the same order
+        :rtype: list(dict)
+        """
+        index = self.index or await self.refresh()
+        return [index.by_code.get(code) for code in codes]
+
+    async def find_card(self, text, trace=NULL_TRACE):
         """
         Finds card with label closest to given text.
         If no card was found, it returns None.
@@ -32,18 +669,57 @@ class Search:
         only matches with score > 50 are considered.
 
         :param string text: the partial label of card.
+        :param obj trace: the trace of request. (default: NULL_TRACE)
         :return: the card closest to given text
         :rtype: dict
         """
-        cards = self.db_client.get_cards()
-        card_index = {card["label"]: card for card in cards}
-        label, score = process.extractOne(
-            text,
-            card_index.keys(),
-            scorer=fuzz.partial_ratio
-        )
+        cards = await self.find_cards([text], trace)
+        return cards[0]
 
-        if score > 50:
-            return card_index[label]
-        else:
-            return None
+    async def find_cards(self, texts, trace=NULL_TRACE):
+        """
+        Finds cards with labels closest to each of given texts.
+
+        All texts are resolved against the same index, each distinct
+        query is scored only once and queries missing in cache are scored
+        as single batch. See :meth:`find_card`.
+
+        Catalog, cache and scoring stages are measured in `trace`,
+        the number of scored candidate labels is added to its attributes.
+
+        :param list texts: the partial labels of cards.
+        :param obj trace: the trace of request. (default: NULL_TRACE)
+        :return: the closest card or None for each text, in the same order
+        :rtype: list(dict)
+        :raises SearchBusy: if search executor cannot accept more work
+        """
+        SEARCH_QUERIES.inc(len(texts))
+        with SEARCH_SECONDS.time():
+            return await self._find_cards(texts, trace)
+
+    async def _find_cards(self, texts, trace):
+        with trace.span("catalog"):
+            index = self.index or await self.refresh()
+        queries = [SearchIndex.normalize(text) for text in texts]
+
+        with trace.span("cache"):
+            found = {}
+            for query in queries:
+                if query not in found:
+                    found[query] = self.results.get(query)
+            missing = [query for query, card in found.items()
+                       if card is ResultCache.MISSING]
+
+        candidates = 0
+        if missing:
+            with trace.span("scoring"):
+                matches, candidates = await self._run(index.best_matches,
+                                                      missing)
+            for query, (card, score) in zip(missing, matches):
+                card = card if score > 50 else None
+                found[query] = card
+                if self.index is index:
+                    self.results.put(query, card)
+
+        trace.attrs["candidates"] = candidates
+        return [found[query] for query in queries]
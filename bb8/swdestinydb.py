@@ -9,8 +9,41 @@ Example:
 
         $ client = SWDestinyClient()
         $ client.get_card("01001")
+
+    Asynchronous client provides the same methods as coroutines::
+
+        $ client = AsyncSWDestinyDBClient()
+        $ await client.get_card("01001")
+
+    Full card catalog can be cached in memory and on local disk::
+
+        $ catalog = CardCatalog(client, path="catalog.json")
+        $ await catalog.get_cards()
 """
+from .card import Card
+from .metrics import HTTP_COALESCED, HTTP_RESPONSES, HTTP_SECONDS
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+import aiohttp
+import asyncio
+import json
+import logging
+import os
+import random
 import requests
+import time
+
+# Response statuses of requests worth retrying.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _freeze(mapping):
+    """Converts request params or headers to hashable value."""
+    if not mapping:
+        return None
+    return tuple(sorted(mapping.items()))
 
 
 class UnsupportedFormat(Exception):
@@ -18,27 +51,103 @@ class UnsupportedFormat(Exception):
     pass
 
 
+CardsResponse = namedtuple("CardsResponse", "cards etag last_modified")
+CardsResponse.__doc__ = """The result of conditional cards request.
+
+Cards are None if catalog was not modified since last request.
+"""
+
+CatalogChange = namedtuple("CatalogChange", "previous cards removed added")
+CatalogChange.__doc__ = """The change of catalog made by incremental refresh.
+
+It contains catalog cards before and after refresh as well as
+cards removed from and added to catalog.
+"""
+
+
 class SWDestinyDBClient:
     """API client for StarWars Destiny DB.
 
     Supports only publicly available endpoints.
     See `official docs <https://swdestinydb.com/api/docs>`_ for more details.
 
+    Requests time out after `timeout` seconds. Failed connections,
+    timeouts and responses with status in RETRY_STATUSES are retried
+    with exponential backoff and full jitter.
+
     :param str base_url: The url where api resources can be found.
                          (default: https://swdestinydb.com/api/public)
     :param str format:  The expected output format. (default: json)
     :param obj session: The HTTP session to communicate with API
-                        (default: requests.Session())
+                        (default: requests.Session() with connection pool
+                        of `pool_size` connections)
+    :param float timeout: The number of seconds to wait for response.
+                          (default: 10)
+    :param int retries: The number of retries of failed request.
+                        (default: 3)
+    :param float backoff: The delay before first retry in seconds.
+                          (default: 0.5)
+    :param float backoff_max: The maximum delay between retries in seconds.
+                              (default: 8)
+    :param int pool_size: The maximum number of concurrent connections.
+                          (default: 10)
     """
 
-    def __init__(self, base_url=None, format="json", session=None):
+    def __init__(self, base_url=None, format="json", session=None,
+                 timeout=10, retries=3, backoff=0.5, backoff_max=8,
+                 pool_size=10):
         self.base_url = base_url or "https://swdestinydb.com/api/public"
         self.format = format
-        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.session = session or self._create_session()
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        return session
+
+    def _backoff(self, attempt):
+        """Gets delay before retry, full jitter is applied.
+
+        :param int attempt: The number of failed attempt, starting from 0
+        :return: The delay in seconds
+        :rtype: float
+        """
+        return random.uniform(0, min(self.backoff_max,
+                                     self.backoff * 2 ** attempt))
 
     def _request(self, uri, params=None):
-        response = self.session.get(uri, params=params)
-        response.raise_for_status()
+        return self._decode(self._get(uri, params=params))
+
+    def _get(self, uri, params=None, headers=None):
+        with HTTP_SECONDS.time():
+            for attempt in range(self.retries + 1):
+                retry = attempt < self.retries
+                try:
+                    response = self.session.get(uri, params=params,
+                                                headers=headers,
+                                                timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout):
+                    HTTP_RESPONSES.inc(status="error")
+                    if not retry:
+                        raise
+                else:
+                    status = response.status_code
+                    HTTP_RESPONSES.inc(status=status)
+                    if not retry or status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return response
+                time.sleep(self._backoff(attempt))
+
+    def _decode(self, response):
         if self.format == "json":
             return response.json()
         else:
@@ -58,6 +167,19 @@ class SWDestinyDBClient:
         uri = "{}/card/{}.{}".format(self.base_url, key, self.format)
         return self._request(uri)
 
+    def get_cards_by_keys(self, keys):
+        """Gets cards with given keys.
+
+        Cards are requested concurrently, using at most `pool_size`
+        connections.
+
+        :param list keys: The card identifiers
+        :return: The cards in the same order as keys
+        :rtype: list(dict)
+        """
+        with ThreadPoolExecutor(self.pool_size) as executor:
+            return list(executor.map(self.get_card, keys))
+
     def get_cards(self, set_code=None):
         """Gets all cards.
 
@@ -76,6 +198,35 @@ class SWDestinyDBClient:
         uri = "{}/cards/{}".format(self.base_url, set_path)
         return self._request(uri)
 
+    def get_cards_if_modified(self, etag=None, last_modified=None):
+        """Gets all cards, unless they were not modified since last request.
+
+        Request is conditional, `etag` and `last_modified` are values
+        returned by previous call of this method.
+
+        :param str etag: The ETag of cached catalog. (default: None)
+        :param str last_modified: The Last-Modified date of cached catalog.
+                                  (default: None)
+        :return: The cards (None if not modified) and new validators
+        :rtype: CardsResponse
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        uri = "{}/cards/".format(self.base_url)
+        response = self._get(uri, headers=headers)
+        if response.status_code == 304:
+            return CardsResponse(None, etag, last_modified)
+
+        return CardsResponse(
+            self._decode(response),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified")
+        )
+
     def get_decklist(self, key):
         """Gets decklist by its identifier.
 
@@ -107,3 +258,435 @@ class SWDestinyDBClient:
         params = {"_format": self.format}
         uri = "{}/sets/".format(self.base_url)
         return self._request(uri, params=params)
+
+
+class AsyncSWDestinyDBClient(SWDestinyDBClient):
+    """Asynchronous API client for StarWars Destiny DB.
+
+    Provides the same methods as :class:`SWDestinyDBClient`, but they
+    return coroutines, so requests do not block event loop.
+
+    Timeouts and retries are the same as in :class:`SWDestinyDBClient`.
+    Concurrent identical requests (same uri, params and headers) are
+    coalesced into single request, whose result is shared by all callers.
+
+    :param str base_url: The url where api resources can be found.
+                         (default: https://swdestinydb.com/api/public)
+    :param str format:  The expected output format. (default: json)
+    :param obj session: The HTTP session to communicate with API
+                        (default: aiohttp.ClientSession() with connection
+                        pool of `pool_size` connections, created on first
+                        request)
+    :param obj loop: The event loop session runs in. (default: None)
+    :param float timeout: The number of seconds to wait for response.
+                          (default: 10)
+    :param int retries: The number of retries of failed request.
+                        (default: 3)
+    :param float backoff: The delay before first retry in seconds.
+                          (default: 0.5)
+    :param float backoff_max: The maximum delay between retries in seconds.
+                              (default: 8)
+    :param int pool_size: The maximum number of concurrent connections.
+                          (default: 10)
+    :param float keepalive: The number of seconds idle connection is kept
+                            open. (default: 30)
+    """
+
+    def __init__(self, base_url=None, format="json", session=None, loop=None,
+                 timeout=10, retries=3, backoff=0.5, backoff_max=8,
+                 pool_size=10, keepalive=30):
+        self.base_url = base_url or "https://swdestinydb.com/api/public"
+        self.format = format
+        self.session = session
+        self.loop = loop
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.in_flight = {}
+        self.sent = 0
+        self.coalesced = 0
+
+    def _create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                         keepalive_timeout=self.keepalive,
+                                         loop=self.loop)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={"Accept-Encoding": "gzip, deflate"},
+            loop=self.loop
+        )
+
+    async def _request(self, uri, params=None):
+        _, _, data = await self._get(uri, params=params)
+        return data
+
+    async def _get(self, uri, params=None, headers=None):
+        """Sends GET request and decodes its response.
+
+        If identical request is already in flight, its result is shared
+        instead of sending another request. Cancelling one of callers
+        does not cancel shared request.
+
+        :return: The response status, headers and decoded data
+                 (None if not modified)
+        :rtype: tuple
+        """
+        key = (uri, _freeze(params), _freeze(headers))
+        request = self.in_flight.get(key)
+        if request is None:
+            self.sent += 1
+            request = asyncio.ensure_future(self._fetch(uri, params, headers),
+                                            loop=self.loop)
+            self.in_flight[key] = request
+            request.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+            HTTP_COALESCED.inc()
+
+        return await asyncio.shield(request, loop=self.loop)
+
+    async def _fetch(self, uri, params, headers):
+        """Sends GET request, retrying failed attempts.
+
+        :return: The response status, headers and decoded data
+                 (None if not modified)
+        :rtype: tuple
+        """
+        if self.session is None:
+            self.session = self._create_session()
+
+        with HTTP_SECONDS.time():
+            for attempt in range(self.retries + 1):
+                retry = attempt < self.retries
+                try:
+                    response = await asyncio.wait_for(
+                        self._send(uri, params, headers, retry),
+                        self.timeout,
+                        loop=self.loop
+                    )
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    HTTP_RESPONSES.inc(status="error")
+                    if not retry:
+                        raise
+                else:
+                    if response is not None:
+                        return response
+                await asyncio.sleep(self._backoff(attempt), loop=self.loop)
+
+    async def _send(self, uri, params, headers, retry):
+        """Sends single GET request.
+
+        :return: The response status, headers and decoded data or None
+                 if request should be retried
+        :rtype: tuple
+        """
+        async with self.session.get(uri, params=params,
+                                    headers=headers) as response:
+            HTTP_RESPONSES.inc(status=response.status)
+            if retry and response.status in RETRY_STATUSES:
+                return None
+
+            response.raise_for_status()
+            data = None
+            if response.status != 304:
+                data = await self._decode(response)
+            return response.status, response.headers, data
+
+    async def _decode(self, response):
+        if self.format == "json":
+            return await response.json()
+        else:
+            raise UnsupportedFormat(
+                "Format {} is not supported.".format(self.format)
+            )
+
+    def stats(self):
+        """Gets request statistics.
+
+        :return: The number of sent and coalesced requests
+        :rtype: dict
+        """
+        return {"sent": self.sent, "coalesced": self.coalesced}
+
+    async def get_cards_if_modified(self, etag=None, last_modified=None):
+        """Gets all cards, unless they were not modified since last request.
+
+        See :meth:`SWDestinyDBClient.get_cards_if_modified`.
+
+        :rtype: CardsResponse
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        uri = "{}/cards/".format(self.base_url)
+        status, response_headers, cards = await self._get(uri,
+                                                          headers=headers)
+        if status == 304:
+            return CardsResponse(None, etag, last_modified)
+
+        return CardsResponse(
+            cards,
+            response_headers.get("ETag"),
+            response_headers.get("Last-Modified")
+        )
+
+    async def get_cards_by_keys(self, keys):
+        """Gets cards with given keys.
+
+        Cards are requested concurrently, using at most `pool_size`
+        connections.
+
+        :param list keys: The card identifiers
+        :return: The cards in the same order as keys
+        :rtype: list(dict)
+        """
+        connections = asyncio.Semaphore(self.pool_size, loop=self.loop)
+
+        async def get_card(key):
+            async with connections:
+                return await self.get_card(key)
+
+        return await asyncio.gather(*(get_card(key) for key in keys),
+                                    loop=self.loop)
+
+    async def close(self):
+        """Closes underlying HTTP session."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# Errors that may be raised by sync or async client during request.
+CLIENT_ERRORS = (
+    requests.RequestException,
+    aiohttp.ClientError,
+    aiohttp.HttpProcessingError,
+    asyncio.TimeoutError
+)
+
+
+class CardCatalog:
+    """Keeps full card catalog in memory and on local disk.
+
+    Catalog is revalidated once it is older than `ttl` seconds. Revalidation
+    is conditional (ETag and Last-Modified), so unchanged catalog is not
+    downloaded again. Snapshot stored in `path` is loaded on first access,
+    so catalog survives restarts without touching network.
+
+    Every time catalog content changes, new list of cards is created and
+    `version` is incremented. Unchanged catalog is always the same list.
+    Cards are kept as compact :class:`Card` records.
+
+    Catalog can be also refreshed incrementally by :meth:`refresh_sets`,
+    which downloads only cards of new or changed sets.
+
+    Catalog is asynchronous, snapshot is read and written in default
+    executor, so event loop is not blocked by disk I/O.
+
+    :param obj db_client: The asynchronous client to get cards from API.
+                          (default: AsyncSWDestinyDBClient())
+    :param str path: The file where catalog snapshot is stored.
+                     (default: None, catalog is kept only in memory)
+    :param int ttl: The number of seconds catalog is considered fresh.
+                    (default: 3600)
+    :param func clock: The function returning current time in seconds.
+                       (default: time.time)
+    """
+
+    def __init__(self, db_client=None, path=None, ttl=3600, clock=time.time):
+        self.db_client = db_client or AsyncSWDestinyDBClient()
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.cards = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = None
+        self.sets = {}
+        self.version = 0
+        self.logger = logging.getLogger(__name__)
+
+    async def get_cards(self):
+        """Gets all cards from catalog.
+
+        Network is used only if there is no snapshot available
+        or cached catalog is stale.
+
+        :return: The list of all cards
+        :rtype: list(Card)
+        """
+        if self.cards is None:
+            await self._in_executor(self.load)
+
+        if self.is_stale():
+            await self.refresh()
+
+        return self.cards
+
+    def is_stale(self):
+        """Checks whether catalog should be revalidated.
+
+        :return: True if catalog is missing or older than ttl
+        :rtype: bool
+        """
+        if self.cards is None or self.fetched_at is None:
+            return True
+        return self.clock() - self.fetched_at >= self.ttl
+
+    def load(self):
+        """Loads catalog snapshot from local disk.
+
+        :return: True if snapshot was loaded
+        :rtype: bool
+        """
+        if not self.path or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            cards = [Card(card) for card in snapshot["cards"]]
+            sets = dict(snapshot.get("sets") or {})
+        except (OSError, ValueError, LookupError, TypeError, AttributeError):
+            self.logger.warning(f"Unable to read catalog snapshot {self.path}",
+                                exc_info=True)
+            return False
+
+        self.cards = cards
+        self.version += 1
+        self.etag = snapshot.get("etag")
+        self.last_modified = snapshot.get("last_modified")
+        self.fetched_at = snapshot.get("fetched_at")
+        self.sets = sets
+        return True
+
+    async def refresh(self):
+        """Revalidates catalog against SWDestinyDB.
+
+        If request fails and there is a cached catalog, it is kept
+        and revalidated again after ttl.
+
+        :return: True if catalog content changed
+        :rtype: bool
+        """
+        try:
+            response = await self.db_client.get_cards_if_modified(
+                etag=self.etag,
+                last_modified=self.last_modified
+            )
+        except CLIENT_ERRORS:
+            if self.cards is None:
+                raise
+            self.logger.warning("Catalog revalidation failed, "
+                                "keeping cached catalog", exc_info=True)
+            self.fetched_at = self.clock()
+            return False
+
+        changed = response.cards is not None
+        if changed:
+            self._update(response.cards)
+        self.etag = response.etag
+        self.last_modified = response.last_modified
+        self.fetched_at = self.clock()
+        if changed or not self.sets:
+            await self._seed_sets()
+        await self._in_executor(self.save)
+        return changed
+
+    async def _seed_sets(self):
+        """Stores sets matching fully downloaded catalog.
+
+        Next incremental refresh then downloads only sets changed since,
+        instead of all sets. If sets cannot be fetched, previous sets
+        are kept, so changed sets are downloaded again at worst.
+        """
+        try:
+            sets = await self.db_client.get_sets()
+        except CLIENT_ERRORS:
+            self.logger.warning("Unable to fetch sets of catalog",
+                                exc_info=True)
+            return
+        self.sets = self._fingerprints(sets)
+
+    @staticmethod
+    def _fingerprints(sets):
+        return {
+            card_set["code"]: json.dumps(card_set, sort_keys=True)
+            for card_set in sets
+        }
+
+    async def refresh_sets(self):
+        """Refreshes only cards of new, changed or removed sets.
+
+        Sets are compared with sets seen by previous incremental refresh,
+        cards of all changed sets are downloaded concurrently. Catalog
+        is changed only after all downloads succeed.
+
+        :return: The change of catalog
+        :rtype: CatalogChange
+        """
+        if self.cards is None:
+            await self._in_executor(self.load)
+
+        sets = await self.db_client.get_sets()
+        fingerprints = self._fingerprints(sets)
+        changed = [code for code, fingerprint in fingerprints.items()
+                   if self.sets.get(code) != fingerprint]
+        outdated = set(changed).union(
+            code for code in self.sets if code not in fingerprints
+        )
+        if not outdated:
+            return CatalogChange(self.cards, self.cards, [], [])
+
+        responses = await asyncio.gather(
+            *(self.db_client.get_cards(code) for code in changed)
+        )
+        added = [Card(card) for cards in responses for card in cards]
+
+        previous = self.cards
+        cards = previous or []
+        removed = [card for card in cards if card.get("set_code") in outdated]
+        self.cards = [card for card in cards
+                      if card.get("set_code") not in outdated] + added
+        self.version += 1
+        self.sets = fingerprints
+        await self._in_executor(self.save)
+        return CatalogChange(previous, self.cards, removed, added)
+
+    def save(self):
+        """Stores catalog snapshot to local disk.
+
+        Snapshot is replaced atomically, so crash never leaves
+        partially written catalog behind.
+        """
+        if not self.path or self.cards is None:
+            return
+
+        snapshot = {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched_at": self.fetched_at,
+            "sets": self.sets,
+            "cards": self.cards
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as snapshot_file:
+                json.dump(snapshot, snapshot_file, default=dict)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            self.logger.warning(f"Unable to store catalog snapshot {self.path}",
+                                exc_info=True)
+
+    def _in_executor(self, func):
+        return asyncio.get_event_loop().run_in_executor(None, func)
+
+    def _update(self, cards):
+        self.cards = [Card(card) for card in cards]
+        self.version += 1
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Throttle module.
+
+This module suppresses repeated lookups and limits how many lookups
+single user can request.
+
+Example:
+    Lookup of card already shown in channel is suppressed::
+
+        $ dedup = DedupWindow(window=10)
+        $ dedup.seen(("destiny", "rey"))
+        False
+        $ dedup.seen(("destiny", "rey"))
+        True
+
+    User can request `rate` lookups per `per` seconds::
+
+        $ throttle = UserThrottle(rate=5, per=10)
+        $ throttle.allow(user.id)
+        True
+"""
+from .dispatch import TokenBucket
+from collections import OrderedDict
+
+import time
+
+
+class DedupWindow:
+    """
+    Remembers recent lookups for `window` seconds.
+
+    Lookup is remembered from its first occurrence, so repeating it does
+    not extend the window. At most `maxsize` lookups are remembered.
+
+    :param float window: the number of seconds lookup is remembered.
+                         (default: 10)
+    :param int maxsize: the maximum number of remembered lookups.
+                        (default: 1024)
+    :param func clock: the function returning current time in seconds.
+                       (default: time.monotonic)
+    """
+
+    def __init__(self, window=10, maxsize=1024, clock=time.monotonic):
+        self.window = window
+        self.maxsize = maxsize
+        self.clock = clock
+        self.entries = OrderedDict()
+
+    def seen(self, key):
+        """
+        Checks whether lookup was seen in window and remembers it if not.
+
+        :param key: the lookup, e.g. channel and normalized query
+        :return: True if lookup should be suppressed
+        :rtype: bool
+        """
+        now = self.clock()
+        while self.entries:
+            oldest, created = next(iter(self.entries.items()))
+            if now - created < self.window:
+                break
+            del self.entries[oldest]
+
+        if key in self.entries:
+            return True
+
+        self.entries[key] = now
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return False
+
+    def forget(self, key):
+        """
+        Forgets lookup, e.g. when it could not be served,
+        so it can be repeated within window.
+
+        :param key: the lookup
+        """
+        self.entries.pop(key, None)
+
+
+class UserThrottle:
+    """
+    Limits each user to `rate` lookups per `per` seconds.
+
+    Buckets of at most `maxsize` recently active users are kept.
+
+    :param int rate: the number of lookups allowed in window.
+                     (default: 5)
+    :param float per: the window length in seconds. (default: 10)
+    :param int maxsize: the maximum number of tracked users.
+                        (default: 1024)
+    :param func clock: the function returning current time in seconds.
+                       (default: time.monotonic)
+    """
+
+    def __init__(self, rate=5, per=10, maxsize=1024, clock=time.monotonic):
+        self.rate = rate
+        self.per = per
+        self.maxsize = maxsize
+        self.clock = clock
+        self.buckets = OrderedDict()
+
+    def allow(self, user):
+        """
+        Takes one lookup of user, if user has any left.
+
+        :param user: the user identifier
+        :return: True if user can request lookup
+        :rtype: bool
+        """
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.per, self.clock)
+            self.buckets[user] = bucket
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user)
+
+        if bucket.delay() > 0:
+            return False
+        bucket.take()
+        return True
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Tracing module.
+
+This module measures stages of handled requests, e.g. parsing, search,
+rendering and sending reply, and logs requests slower than threshold.
+
+Example:
+    Each request is traced and its stages are measured by spans::
+
+        $ tracer = Tracer(threshold=0.5)
+        $ with tracer.trace("card", query="rey") as trace:
+        $     with trace.span("search"):
+        $         card = await search.find_card("rey")
+
+    Slow requests are logged to `bb8.slow` logger as JSON::
+
+        {"name": "card", "query": "rey", "elapsed_ms": 612.4,
+         "stages": {"search": 610.2}}
+
+    Dispatcher holds trace of request until its replies are sent and adds
+    their `queue` and `send` stages::
+
+        $ dispatcher.enqueue(channel, embed=embed, trace=trace)
+"""
+from collections import OrderedDict
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import time
+
+
+class Span:
+    """
+    Context manager adding duration of its block to trace stage.
+
+    :param obj trace: the trace stage belongs to.
+    :param str stage: the stage name
+    """
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.trace.add(self.stage, time.perf_counter() - self.start)
+
+
+class Trace:
+    """
+    Timing of single request split to stages.
+
+    Stage measured more than once, e.g. send of multiple replies,
+    accumulates its durations.
+
+    Work outliving request, e.g. reply waiting in dispatcher queue,
+    holds trace, so trace is reported only after all holds are released.
+
+    :param str name: the request name, e.g. command name
+    :param attrs: the request attributes logged with trace, e.g. query
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.stages = OrderedDict()
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.held = 0
+        self.on_release = None
+
+    def span(self, stage):
+        """
+        Measures duration of `with` block as stage.
+
+        :param str stage: the stage name, e.g. search
+        :rtype: Span
+        """
+        return Span(self, stage)
+
+    def add(self, stage, elapsed):
+        """
+        Adds duration to stage.
+
+        :param str stage: the stage name
+        :param float elapsed: the duration in seconds
+        """
+        self.stages[stage] = self.stages.get(stage, 0) + elapsed
+
+    def hold(self):
+        """
+        Delays reporting of trace until matching :meth:`release`.
+        """
+        self.held += 1
+
+    def release(self):
+        """
+        Releases hold of trace, trace is reported when last hold
+        of finished request is released.
+        """
+        self.held -= 1
+        if self.held == 0 and self.on_release is not None:
+            report, self.on_release = self.on_release, None
+            report()
+
+    def finish(self):
+        """
+        Stops measuring request.
+
+        :return: the request duration in seconds
+        """
+        self.elapsed = time.perf_counter() - self.start
+        return self.elapsed
+
+    def to_dict(self):
+        """
+        Gets trace as structured record with durations in milliseconds.
+
+        :rtype: dict
+        """
+        record = OrderedDict(name=self.name)
+        record.update(self.attrs)
+        record["elapsed_ms"] = round(self.elapsed * 1000, 1)
+        record["stages"] = OrderedDict(
+            (stage, round(elapsed * 1000, 1))
+            for stage, elapsed in self.stages.items()
+        )
+        return record
+
+
+class NullTrace(Trace):
+    """
+    Trace that measures nothing, used when caller does not trace request.
+    """
+
+    def __init__(self):
+        super().__init__(None)
+
+    def add(self, stage, elapsed):
+        pass
+
+    def hold(self):
+        pass
+
+    def release(self):
+        pass
+
+
+# Trace used when caller does not trace request.
+NULL_TRACE = NullTrace()
+
+
+class Tracer:
+    """
+    Traces requests and logs slow ones.
+
+    Requests slower than `threshold` are logged to `bb8.slow` logger
+    as JSON with their attributes and stage breakdown.
+
+    Sampled requests can be profiled with cProfile, profiling is enabled
+    for one request at a time. Profiler sees only event loop thread,
+    including other coroutines running meanwhile, but not executors.
+    Profile of sampled request is logged regardless of its duration.
+
+    Held trace is reported when its last hold is released, so its
+    duration includes e.g. time its replies waited in dispatcher queue.
+    Profile covers only request itself.
+
+    :param float threshold: the number of seconds request is considered
+                            slow after. (default: 1)
+    :param float profile_rate: the fraction of requests profiled, between
+                               0 and 1. (default: 0, nothing is profiled)
+    :param int profile_limit: the number of functions in logged profile.
+                              (default: 25)
+    :param func random: the function returning random number in [0, 1).
+                        (default: random.random)
+    """
+
+    def __init__(self, threshold=1, profile_rate=0, profile_limit=25,
+                 random=random.random):
+        self.threshold = threshold
+        self.profile_rate = profile_rate
+        self.profile_limit = profile_limit
+        self.random = random
+        self.profiling = False
+        self.logger = logging.getLogger("bb8.slow")
+
+    def trace(self, name, **attrs):
+        """
+        Traces request during `with` block.
+
+        :param str name: the request name, e.g. command name
+        :param attrs: the request attributes, e.g. query
+        :rtype: TracedRequest
+        """
+        return TracedRequest(self, Trace(name, **attrs))
+
+    def _start_profile(self):
+        if self.profiling or self.random() >= self.profile_rate:
+            return None
+        self.profiling = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _finish(self, trace, profile):
+        output = None
+        if profile is not None:
+            profile.disable()
+            self.profiling = False
+            output = io.StringIO()
+            stats = pstats.Stats(profile, stream=output)
+            stats.sort_stats("cumulative").print_stats(self.profile_limit)
+
+        def report():
+            elapsed = trace.finish()
+            if output is not None:
+                self.logger.info("Profile of %s\n%s",
+                                 json.dumps(trace.to_dict()),
+                                 output.getvalue())
+            elif elapsed >= self.threshold:
+                self.logger.warning(json.dumps(trace.to_dict()))
+
+        if trace.held:
+            trace.on_release = report
+        else:
+            report()
+
+
+class TracedRequest:
+    """
+    Context manager tracing request and reporting it when finished.
+
+    :param obj tracer: the tracer reporting request.
+    :param obj trace: the trace of request.
+    """
+
+    def __init__(self, tracer, trace):
+        self.tracer = tracer
+        self.trace = trace
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = self.tracer._start_profile()
+        return self.trace
+
+    def __exit__(self, *_):
+        self.tracer._finish(self.trace, self.profile)
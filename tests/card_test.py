@@ -0,0 +1,49 @@
+from bb8.card import Card
+
+import pytest
+
+
+@pytest.fixture
+def data():
+    return {
+        "code": "01001",
+        "label": "Captain Phasma",
+        "sides": ["1R", "2R", "1F", "1Dr", "1R", "-"],
+        "set_name": "Awakenings",
+        "faction_code": "red",
+        "points": "12/15",
+        "health": 10,
+        "cost": None,
+        "flavor": "Not kept",
+        "reprints": []
+    }
+
+
+def test_card_keeps_only_known_fields(data):
+    card = Card(data)
+
+    assert card["label"] == "Captain Phasma"
+    assert card["cost"] is None
+    assert "flavor" not in card
+    assert "text" not in card
+    with pytest.raises(KeyError):
+        card["reprints"]
+
+
+def test_card_behaves_like_dict(data):
+    card = Card(data)
+
+    assert card.get("text", "(no text)") == "(no text)"
+    assert "Points: {points}".format(**card) == "Points: 12/15"
+    assert dict(card)["sides"] == ("1R", "2R", "1F", "1Dr", "1R", "-")
+    assert card == Card(dict(card))
+
+
+def test_card_shares_repeated_strings(data):
+    other = dict(data, set_name="".join(["Awaken", "ings"]))
+
+    assert Card(data)["set_name"] is Card(other)["set_name"]
+
+
+def test_card_has_no_instance_dict(data):
+    assert not hasattr(Card(data), "__dict__")
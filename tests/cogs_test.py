@@ -1,14 +1,20 @@
 from bb8.cogs import SWCardSearch
-from bb8.embed import CardDetail, CardImage
+from bb8.dispatch import Dispatcher
+from bb8.embed import CardDetail, CardImage, EmbedCache, EmojiCache
+from bb8.search import SearchBusy
+from bb8.throttle import DedupWindow, UserThrottle
+from bb8.tracing import Tracer
 from collections import namedtuple
 from discord import Emoji
 from discord.ext.commands import Bot, Context, view
+from unittest import mock
 
+import aiohttp
 import asyncio
 import pytest
 
 User = namedtuple('User', 'id,bot')
-Server = namedtuple('Server', 'emojis')
+Server = namedtuple('Server', 'id,emojis')
 Message = namedtuple('Message', 'author,content,channel,server')
 
 
@@ -41,7 +47,7 @@ card = {
     "rarity_name": "Legendary"
 }
 
-server = Server(emojis=emojis)
+server = Server(id="1", emojis=emojis)
 
 
 class ImageMatcher:
@@ -70,14 +76,42 @@ class DetailMatcher:
         return len(self.embed.fields) == 1
 
 
+class BusySearch:
+
+    async def find_card(self, text, trace=None):
+        raise SearchBusy()
+
+    async def find_cards(self, texts, trace=None):
+        raise SearchBusy()
+
+
 class MockSearch:
 
-    def find_card(self, text):
+    async def find_card(self, text, trace=None):
         if 'captain' in text.lower():
             return card
         else:
             return None
 
+    async def find_cards(self, texts, trace=None):
+        return [await self.find_card(text) for text in texts]
+
+    async def find_cards_by_code(self, codes):
+        return [card if code == "10001" else None for code in codes]
+
+
+class MockDecklists:
+
+    async def get(self, key):
+        if key != 19504:
+            raise aiohttp.HttpProcessingError(code=404)
+        return {
+            "id": 19504,
+            "name": "Phasma",
+            "characters": {"10001": {"quantity": 1, "dice": 2}},
+            "slots": {"01045": {"quantity": 2, "dice": 0}}
+        }
+
 
 @pytest.fixture
 def search():
@@ -97,6 +131,13 @@ def bot(search, mocker):
         spec=Bot,
         user=User(id="1", bot=True),
         search=search,
+        decklists=MockDecklists(),
+        emoji_cache=EmojiCache(),
+        embed_cache=EmbedCache(),
+        tracer=Tracer(),
+        dispatcher=mocker.MagicMock(spec=Dispatcher),
+        dedup=DedupWindow(),
+        throttle=UserThrottle(rate=2),
         **attrs
     )
 
@@ -132,9 +173,11 @@ async def test_on_message_finds_correct_card(bot, swcardsearch):
 
     await swcardsearch.on_message(msg)
 
-    bot.send_message.assert_called_once_with(
+    bot.dispatcher.enqueue.assert_called_once_with(
         "destiny",
-        embed=DetailMatcher(card)
+        None,
+        embed=DetailMatcher(card),
+        trace=mock.ANY
     )
     
 
@@ -150,9 +193,11 @@ async def test_on_message_finds_correct_card_image(bot, swcardsearch):
 
     await swcardsearch.on_message(msg)
 
-    bot.send_message.assert_called_once_with(
+    bot.dispatcher.enqueue.assert_called_once_with(
         "destiny",
-        embed=ImageMatcher(card)
+        None,
+        embed=ImageMatcher(card),
+        trace=mock.ANY
     )
 
 
@@ -168,12 +213,74 @@ async def test_on_message_card_not_found(bot, swcardsearch):
 
     await swcardsearch.on_message(msg)
 
-    bot.send_message.assert_called_once_with(
+    bot.dispatcher.enqueue.assert_called_once_with(
+        "destiny",
+        'No card found for "xxx". :(',
+        embed=None,
+        trace=mock.ANY
+    )
+
+
+@pytest.mark.asyncio
+async def test_on_message_escapes_missed_terms(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="[[@everyone]] [[<@&123>]] [[*bold*]]",
+        channel="destiny",
+        server=server
+    )
+
+    await swcardsearch.on_message(msg)
+
+    bot.dispatcher.enqueue.assert_called_once_with(
+        "destiny",
+        'No card found for "@\u200beveryone", "<\u200b@\u200b&123\\>", '
+        '"\\*bold\\*". :(',
+        embed=None,
+        trace=mock.ANY
+    )
+
+
+@pytest.mark.asyncio
+async def test_on_message_finds_all_mentioned_cards(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="[[captain]]\n[[xxx]]\n[[captain]]",
+        channel="destiny",
+        server=server
+    )
+
+    await swcardsearch.on_message(msg)
+
+    bot.dispatcher.enqueue.assert_called_once_with(
         "destiny",
-        "No card found. :("
+        'No card found for "xxx". :(',
+        embed=DetailMatcher(card),
+        trace=mock.ANY
     )
 
 
+@pytest.mark.asyncio
+async def test_on_message_coalesces_replies(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="[[xxx]] [[!captain]] [[yyy]] [[captain]] [[Captain]] [[!xxx]]",
+        channel="destiny",
+        server=server
+    )
+
+    await swcardsearch.on_message(msg)
+
+    assert bot.dispatcher.enqueue.call_args_list == [
+        mock.call("destiny", 'No card found for "xxx", "yyy". :(',
+                  embed=ImageMatcher(card), trace=mock.ANY),
+        mock.call("destiny", None, embed=DetailMatcher(card), trace=mock.ANY),
+    ]
+
+
 @pytest.mark.asyncio
 async def test_on_message_unknown_pattern(bot, swcardsearch):
     user = User(id=2, bot=False)
@@ -203,7 +310,7 @@ async def test_card_returns_correct_card(bot, swcardsearch):
     await swcardsearch.card.invoke(ctx)
 
     embed = DetailMatcher(card)
-    bot.say.assert_called_once_with(embed=embed)
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", embed=embed, trace=mock.ANY)
 
 
 @pytest.mark.asyncio
@@ -219,7 +326,7 @@ async def test_card_not_found(bot, swcardsearch):
 
     await swcardsearch.card.invoke(ctx)
 
-    bot.say.assert_called_once_with("Card not found :(")
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", "Card not found :(", trace=mock.ANY)
 
 
 @pytest.mark.asyncio
@@ -236,7 +343,7 @@ async def test_card_image_returns_correct_image(bot, swcardsearch):
     await swcardsearch.card_image.invoke(ctx)
 
     embed = ImageMatcher(card)
-    bot.say.assert_called_once_with(embed=embed)
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", embed=embed, trace=mock.ANY)
 
 
 @pytest.mark.asyncio
@@ -252,5 +359,216 @@ async def test_card_image_not_found(bot, swcardsearch):
 
     await swcardsearch.card_image.invoke(ctx)
 
-    bot.say.assert_called_once_with("Card not found :(")
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", "Card not found :(", trace=mock.ANY)
+
+
+
+@pytest.mark.asyncio
+async def test_card_when_search_is_busy(bot, swcardsearch):
+    bot.search = BusySearch()
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="captain phasma",
+        channel="destiny",
+        server=server
+    )
+    ctx = Context(message=msg, bot=bot, prefix="!", view=view.StringView(msg.content))
+
+    await swcardsearch.card.invoke(ctx)
+
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", SWCardSearch.BUSY_MESSAGE, trace=mock.ANY)
+
+
+@pytest.mark.asyncio
+async def test_on_message_when_search_is_busy(bot, swcardsearch):
+    bot.search = BusySearch()
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="[[captain]]",
+        channel="destiny",
+        server=server
+    )
+
+    await swcardsearch.on_message(msg)
+
+    bot.dispatcher.enqueue.assert_called_once_with(
+        "destiny",
+        SWCardSearch.BUSY_MESSAGE,
+        trace=mock.ANY
+    )
+
+
+class DeckMatcher:
+    """
+    Matcher that checks deck summary embed.
+    """
+
+    def __init__(self, title, characters):
+        self.title = title
+        self.characters = characters
+
+    def __eq__(self, other):
+        return (other.title == self.title and
+                other.fields[0].value == self.characters)
+
 
+@pytest.mark.asyncio
+async def test_deck_returns_deck_summary(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="19504",
+        channel="destiny",
+        server=server
+    )
+    ctx = Context(message=msg, bot=bot, prefix="!", view=view.StringView(msg.content))
+
+    await swcardsearch.deck.invoke(ctx)
+
+    bot.dispatcher.enqueue.assert_called_once_with(
+        "destiny",
+        embed=DeckMatcher("Phasma", "Elite Captain Phasma"),
+        trace=mock.ANY
+    )
+
+
+@pytest.mark.asyncio
+async def test_deck_not_found(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="1",
+        channel="destiny",
+        server=server
+    )
+    ctx = Context(message=msg, bot=bot, prefix="!", view=view.StringView(msg.content))
+
+    await swcardsearch.deck.invoke(ctx)
+
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", "Deck not found :(", trace=mock.ANY)
+
+
+@pytest.mark.asyncio
+async def test_deck_when_catalog_is_not_available(bot, swcardsearch):
+    class ColdSearch(MockSearch):
+
+        async def find_cards_by_code(self, codes):
+            raise aiohttp.ClientConnectionError()
+
+    bot.search = ColdSearch()
+    user = User(id=2, bot=False)
+    msg = Message(
+        author=user,
+        content="19504",
+        channel="destiny",
+        server=server
+    )
+    ctx = Context(message=msg, bot=bot, prefix="!", view=view.StringView(msg.content))
+
+    await swcardsearch.deck.invoke(ctx)
+
+    bot.dispatcher.enqueue.assert_called_once_with("destiny", "Cards not available :(", trace=mock.ANY)
+
+
+@pytest.mark.asyncio
+async def test_on_message_suppresses_repeated_mentions(bot, swcardsearch):
+    first = Message(
+        author=User(id=2, bot=False),
+        content="[[captain]]",
+        channel="destiny",
+        server=server
+    )
+    second = Message(
+        author=User(id=3, bot=False),
+        content="[[Captain]] [[!captain]]",
+        channel="destiny",
+        server=server
+    )
+
+    await swcardsearch.on_message(first)
+    await swcardsearch.on_message(second)
+
+    assert bot.dispatcher.enqueue.call_args_list == [
+        mock.call("destiny", None, embed=DetailMatcher(card), trace=mock.ANY),
+        mock.call("destiny", None, embed=ImageMatcher(card), trace=mock.ANY),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_on_message_throttles_user(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    for content in ["[[captain]]", "[[xxx]]", "[[yyy]]"]:
+        msg = Message(
+            author=user,
+            content=content,
+            channel="destiny",
+            server=server
+        )
+        await swcardsearch.on_message(msg)
+
+    assert bot.dispatcher.enqueue.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_on_message_retries_lookup_after_busy_search(bot, swcardsearch):
+    msg = Message(
+        author=User(id=2, bot=False),
+        content="[[captain]]",
+        channel="destiny",
+        server=server
+    )
+
+    bot.search = BusySearch()
+    await swcardsearch.on_message(msg)
+    bot.search = MockSearch()
+    await swcardsearch.on_message(msg)
+
+    assert bot.dispatcher.enqueue.call_args_list == [
+        mock.call("destiny", SWCardSearch.BUSY_MESSAGE, trace=mock.ANY),
+        mock.call("destiny", None, embed=DetailMatcher(card), trace=mock.ANY),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_on_message_duplicates_do_not_throttle_user(bot, swcardsearch):
+    user = User(id=2, bot=False)
+    for content in ["[[captain]]", "[[captain]]", "[[captain]]", "[[xxx]]"]:
+        msg = Message(
+            author=user,
+            content=content,
+            channel="destiny",
+            server=server
+        )
+        await swcardsearch.on_message(msg)
+
+    assert bot.dispatcher.enqueue.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_on_message_retries_lookup_after_failed_search(bot, swcardsearch):
+    class ColdSearch(MockSearch):
+
+        async def find_cards(self, texts, trace=None):
+            raise aiohttp.ClientConnectionError()
+
+    msg = Message(
+        author=User(id=2, bot=False),
+        content="[[captain]]",
+        channel="destiny",
+        server=server
+    )
+
+    bot.search = ColdSearch()
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await swcardsearch.on_message(msg)
+    bot.search = MockSearch()
+    await swcardsearch.on_message(msg)
+
+    bot.dispatcher.enqueue.assert_called_once_with(
+        "destiny",
+        None,
+        embed=DetailMatcher(card),
+        trace=mock.ANY
+    )
@@ -0,0 +1,79 @@
+from bb8.deck import Deck, Decklists
+
+import pytest
+
+cards = {
+    "01001": {"code": "01001", "label": "Rey - Force Prodigy",
+              "type_code": "character", "points": "12/16"},
+    "01002": {"code": "01002", "label": "Rebel Trooper",
+              "type_code": "character", "points": "7"},
+    "01003": {"code": "01003", "label": "Echo Base",
+              "type_code": "battlefield"},
+    "01004": {"code": "01004", "label": "Espionage",
+              "type_code": "plot", "points": "1"},
+    "01005": {"code": "01005", "label": "Force Throw",
+              "type_code": "event"},
+    "01006": {"code": "01006", "label": "Lightsaber",
+              "type_code": "upgrade"}
+}
+
+decklist = {
+    "id": 19504,
+    "name": "Make Jar Jar Good Again!",
+    "characters": {
+        "01001": {"quantity": 1, "dice": 2},
+        "01002": {"quantity": 2, "dice": 2}
+    },
+    "slots": {
+        "01003": {"quantity": 1, "dice": 0},
+        "01004": {"quantity": 1, "dice": 0},
+        "01005": {"quantity": 2, "dice": 0},
+        "01006": {"quantity": 2, "dice": 2},
+        "99999": {"quantity": 1, "dice": 0}
+    }
+}
+
+
+class MockDecklistClient:
+    def __init__(self):
+        self.requests = []
+
+    async def get_decklist(self, key):
+        self.requests.append(key)
+        return decklist
+
+
+def test_deck_summary():
+    deck = Deck(decklist, cards)
+
+    assert deck.name == "Make Jar Jar Good Again!"
+    assert deck.url == "https://swdestinydb.com/decklist/view/19504"
+    assert deck.characters == ["Elite Rey - Force Prodigy", "2x Rebel Trooper"]
+    assert deck.battlefields == ["Echo Base"]
+    assert deck.plots == ["Espionage"]
+    assert deck.points == 16 + 2 * 7 + 1
+    assert deck.dice == 6
+    assert deck.cards == 4
+    assert deck.unknown == ["99999"]
+
+
+def test_deck_lists_unknown_character_by_code():
+    unresolved = {"characters": {"99998": {"quantity": 2, "dice": 2}}}
+
+    deck = Deck(unresolved, cards)
+
+    assert deck.characters == []
+    assert deck.unknown == ["2x 99998"]
+    assert deck.cards == 0
+    assert deck.dice == 2
+
+
+@pytest.mark.asyncio
+async def test_decklists_are_fetched_once():
+    db_client = MockDecklistClient()
+    decklists = Decklists(db_client)
+
+    await decklists.get(19504)
+    assert await decklists.get(19504) is decklist
+
+    assert db_client.requests == [19504]
@@ -0,0 +1,158 @@
+from bb8.dispatch import Dispatcher, TokenBucket
+from bb8.tracing import Trace
+
+import asyncio
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Channel:
+    def __init__(self, id):
+        self.id = id
+
+
+class Sender:
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, destination, content=None, embed=None):
+        self.sent.append((destination.id, content, embed))
+
+
+async def drain(dispatcher):
+    while dispatcher.workers:
+        await asyncio.sleep(0)
+
+
+def test_token_bucket_allows_burst_then_paces():
+    clock = Clock()
+    bucket = TokenBucket(5, 5, clock)
+
+    for _ in range(5):
+        assert bucket.delay() == 0
+        bucket.take()
+
+    assert bucket.delay() == pytest.approx(1)
+    clock.now = 0.5
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now = 1
+    assert bucket.delay() == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_sends_replies_in_order(event_loop):
+    send = Sender()
+    dispatcher = Dispatcher(send, loop=event_loop)
+    channel = Channel(1)
+
+    dispatcher.enqueue(channel, embed="rey")
+    dispatcher.enqueue(channel, "Not found")
+    dispatcher.enqueue(channel, embed="phasma")
+    await drain(dispatcher)
+
+    assert send.sent == [
+        (1, None, "rey"), (1, "Not found", None), (1, None, "phasma")
+    ]
+    assert not dispatcher.queues
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_merges_queued_text_replies(event_loop):
+    send = Sender()
+    dispatcher = Dispatcher(send, loop=event_loop)
+    channel = Channel(1)
+
+    dispatcher.enqueue(channel, "Card not found :(")
+    dispatcher.enqueue(channel, "Deck not found :(")
+    await drain(dispatcher)
+
+    assert send.sent == [(1, "Card not found :(\nDeck not found :(", None)]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_drops_oldest_reply_when_full(event_loop):
+    send = Sender()
+    dispatcher = Dispatcher(send, max_pending=2, loop=event_loop)
+    channel = Channel(1)
+
+    for embed in ["rey", "phasma", "kylo"]:
+        dispatcher.enqueue(channel, embed=embed)
+    await drain(dispatcher)
+
+    assert [embed for _, _, embed in send.sent] == ["phasma", "kylo"]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_drops_stale_replies(event_loop):
+    send = Sender()
+    clock = Clock()
+    dispatcher = Dispatcher(send, max_age=30, loop=event_loop, clock=clock)
+    channel = Channel(1)
+
+    dispatcher.enqueue(channel, embed="rey")
+    clock.now = 31
+    dispatcher.enqueue(channel, embed="phasma")
+    await drain(dispatcher)
+
+    assert send.sent == [(1, None, "phasma")]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_does_not_delay_other_channels(event_loop):
+    send = Sender()
+    dispatcher = Dispatcher(send, rate=1, per=60, loop=event_loop,
+                            clock=Clock())
+    busy, quiet = Channel(1), Channel(2)
+
+    dispatcher.enqueue(busy, embed="rey")
+    dispatcher.enqueue(busy, embed="phasma")
+    dispatcher.enqueue(quiet, embed="kylo")
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert send.sent == [(1, None, "rey"), (2, None, "kylo")]
+    assert dispatcher.pending() == 1
+
+    await dispatcher.close()
+    assert not dispatcher.workers
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_adds_reply_stages_to_trace(event_loop):
+    send = Sender()
+    clock = Clock()
+    dispatcher = Dispatcher(send, loop=event_loop, clock=clock)
+    trace, merged = Trace("card"), Trace("deck")
+
+    dispatcher.enqueue(Channel(1), "Card not found :(", trace=trace)
+    dispatcher.enqueue(Channel(1), "Deck not found :(", trace=merged)
+    assert trace.held == merged.held == 1
+    clock.now = 2
+    await drain(dispatcher)
+
+    for trace in [trace, merged]:
+        assert not trace.held
+        assert list(trace.stages) == ["queue", "send"]
+        assert trace.stages["queue"] == 2
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_releases_trace_of_dropped_reply(event_loop):
+    send = Sender()
+    clock = Clock()
+    dispatcher = Dispatcher(send, max_age=30, loop=event_loop, clock=clock)
+    trace = Trace("card")
+
+    dispatcher.enqueue(Channel(1), embed="rey", trace=trace)
+    clock.now = 31
+    await drain(dispatcher)
+
+    assert not trace.held
+    assert not trace.stages
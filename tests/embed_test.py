@@ -1,8 +1,12 @@
-from bb8.embed import CardDetail, CardEmbed, CardImage
+from bb8.embed import (CardDetail, CardEmbed, CardImage, EmbedCache,
+                       EmojiCache, EmojiSubstitutions)
+from collections import namedtuple
 from discord import Emoji
 
 import pytest
 
+Server = namedtuple('Server', 'id,emojis')
+
 
 @pytest.fixture
 def emojis():
@@ -221,3 +225,121 @@ def test_render_proper_battlefield_detail(emojis):
     assert body.value.strip() == "**Claim** - Reveal the top card of an opponent's deck. If that card is an event or support, deal 1 damage to a character." 
     assert embed.footer.text == "Adam Lane • Two-Player Game #23"
 
+
+
+def test_emoji_substitutions(emojis):
+    substitutions = EmojiSubstitutions(emojis)
+
+    assert substitutions.text == {
+        "blank": "<:swblank:5>",
+        "ranged": "<:swranged:1>"
+    }
+    assert substitutions.side["RD"] == "<:swranged:1>"
+    assert "Sp" not in substitutions.side
+
+
+def test_emoji_cache_caches_server_substitutions(emojis):
+    server = Server(id="1", emojis=emojis)
+    cache = EmojiCache()
+
+    assert cache.get(server) is cache.get(server)
+
+
+def test_emoji_cache_invalidates_server_substitutions(emojis):
+    server = Server(id="1", emojis=emojis)
+    cache = EmojiCache()
+    substitutions = cache.get(server)
+
+    cache.invalidate(server)
+
+    assert cache.get(server) is not substitutions
+
+
+def test_renders_icons_and_markup_in_text(emojis):
+    card = {
+        "label": "Hidden Blade",
+        "url": "https://swdestinydb.com/cards/01045",
+        "imagesrc": "https://swdestinydb.com/cards/01045.png",
+        "faction_code": "red",
+        "text": "<b>Ambush</b>. <i>Deal</i> [ranged] or [special] damage. <b>Redeploy</b>"
+    }
+
+    text = CardDetail(card, emojis).text_line()
+
+    assert text == "**Ambush**. *Deal* <:swranged:1> or [special] damage. **Redeploy**"
+
+
+def test_renders_dice_sides_without_emojis():
+    card = {
+        "label": "Captain Phasma",
+        "url": "https://swdestinydb.com/cards/10001",
+        "imagesrc": "https://swdestinydb.com/cards/10001.png",
+        "faction_code": "red",
+        "sides": ["1RD", "0MD", "+2ID1", "-"]
+    }
+
+    text = CardDetail(card, []).text_line()
+
+    assert text == "(no text)\n1 RD | X MD | +2 ID / 1 R | -\n"
+
+
+def test_embed_cache_returns_copies_of_cached_embed():
+    card = {
+        "code": "01001",
+        "label": "Captain Phasma",
+        "url": "https://swdestinydb.com/cards/01001",
+        "imagesrc": "https://swdestinydb.com/cards/01001.png",
+        "faction_code": "red"
+    }
+    cache = EmbedCache()
+
+    embed = cache.image(card)
+    embed.set_image(url="https://example.com/modified.png")
+
+    assert cache.image(card).image.url == card["imagesrc"]
+    assert len(cache.entries) == 1
+
+
+def test_embed_cache_separates_emoji_profiles(emojis):
+    card = {
+        "code": "01001",
+        "label": "Captain Phasma",
+        "url": "https://swdestinydb.com/cards/01001",
+        "imagesrc": "https://swdestinydb.com/cards/01001.png",
+        "faction_code": "red",
+        "type_code": "battlefield",
+        "type_name": "Battlefield",
+        "affiliation_name": "Neutral",
+        "faction_name": "General",
+        "rarity_name": "Starter",
+        "text": "[ranged]",
+        "set_name": "Awakenings",
+        "position": 1
+    }
+    cache = EmbedCache()
+
+    with_emojis = cache.detail(card, EmojiSubstitutions(emojis))
+    without_emojis = cache.detail(card, EmojiSubstitutions([]))
+
+    assert with_emojis.fields[0].value == "<:swranged:1>"
+    assert without_emojis.fields[0].value == "[ranged]"
+    assert cache.detail(card, EmojiSubstitutions(emojis)).to_dict() == with_emojis.to_dict()
+
+
+def test_embed_cache_renders_changed_card_again():
+    card = {
+        "code": "01001",
+        "label": "Captain Phasma",
+        "url": "https://swdestinydb.com/cards/01001",
+        "imagesrc": "https://swdestinydb.com/cards/01001.png",
+        "faction_code": "red"
+    }
+    cache = EmbedCache()
+    cache.image(card)
+
+    unchanged = dict(card)
+    changed = dict(card, imagesrc="https://swdestinydb.com/cards/01001-v2.png")
+
+    assert cache.image(unchanged).image.url == card["imagesrc"]
+    assert cache.image(changed).image.url == changed["imagesrc"]
+    assert len(cache.entries) == 1
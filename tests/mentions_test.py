@@ -0,0 +1,35 @@
+from bb8.mentions import MAX_LENGTH, extract_mentions
+
+
+def test_extract_mentions_without_brackets():
+    assert extract_mentions("Hello bb8") == []
+
+
+def test_extract_mentions_is_not_greedy():
+    assert extract_mentions("[[Rey]] and [[Phasma]]") == ["Rey", "Phasma"]
+
+
+def test_extract_mentions_keeps_order_without_duplicates():
+    content = "[[Rey]] [[!Phasma]]\n[[Rey]] [[ Kylo ]]"
+
+    assert extract_mentions(content) == ["Rey", "!Phasma", "Kylo"]
+
+
+def test_extract_mentions_ignores_malformed_mentions():
+    content = "[[]] [[!]] [[Rey]] [[Phas\nma]] [[[Kylo]]]"
+
+    assert extract_mentions(content) == ["Rey", "Kylo"]
+
+
+def test_extract_mentions_ignores_long_terms():
+    content = "[[{}]] [[Rey]]".format("x" * (MAX_LENGTH + 1))
+
+    assert extract_mentions(content) == ["Rey"]
+
+
+def test_extract_mentions_caps_number_of_mentions():
+    content = " ".join("[[card {}]]".format(i) for i in range(100))
+
+    assert extract_mentions(content, max_mentions=3) == [
+        "card 0", "card 1", "card 2"
+    ]
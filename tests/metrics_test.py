@@ -0,0 +1,81 @@
+from bb8.metrics import MetricsServer, Registry
+
+import aiohttp
+import pytest
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_counts_each_series(registry):
+    counter = registry.counter("requests_total", "Requests", ["status"])
+
+    counter.inc(status=200)
+    counter.inc(status=200)
+    counter.inc(3, status="error")
+
+    assert counter.value(status=200) == 2
+    assert counter.value(status="error") == 3
+    assert counter.value(status=404) == 0
+
+
+def test_metric_rejects_unknown_labels(registry):
+    counter = registry.counter("requests_total", "Requests", ["status"])
+
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_registry_rejects_duplicate_metric(registry):
+    registry.counter("requests_total", "Requests")
+
+    with pytest.raises(ValueError):
+        registry.histogram("requests_total", "Requests")
+
+
+def test_histogram_renders_cumulative_buckets(registry):
+    histogram = registry.histogram("render_seconds", "Render", ["embed"],
+                                   buckets=[0.1, 1])
+
+    histogram.observe(0.05, embed="detail")
+    histogram.observe(0.5, embed="detail")
+    histogram.observe(5, embed="detail")
+
+    assert registry.render() == (
+        '# HELP render_seconds Render\n'
+        '# TYPE render_seconds histogram\n'
+        'render_seconds_bucket{embed="detail",le="0.1"} 1\n'
+        'render_seconds_bucket{embed="detail",le="1.0"} 2\n'
+        'render_seconds_bucket{embed="detail",le="+Inf"} 3\n'
+        'render_seconds_count{embed="detail"} 3\n'
+        'render_seconds_sum{embed="detail"} 5.55\n'
+    )
+
+
+def test_histogram_times_block(registry):
+    histogram = registry.histogram("search_seconds", "Search")
+
+    with histogram.time():
+        pass
+
+    assert histogram.count() == 1
+
+
+@pytest.mark.asyncio
+async def test_server_exports_metrics(registry, event_loop, unused_tcp_port):
+    registry.counter("requests_total", "Requests").inc()
+    server = MetricsServer(registry, port=unused_tcp_port, loop=event_loop)
+    await server.start()
+
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(unused_tcp_port)
+        async with aiohttp.ClientSession(loop=event_loop) as session:
+            async with session.get(url) as response:
+                text = await response.text()
+    finally:
+        await server.stop()
+
+    assert response.status == 200
+    assert "requests_total 1.0\n" in text
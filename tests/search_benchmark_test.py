@@ -0,0 +1,225 @@
+"""
+Benchmarks of card search over full-size catalog.
+
+Benchmarks are slow, so they run only if BENCHMARK environment variable
+is set::
+
+    $ BENCHMARK=1 pytest tests/search_benchmark_test.py -s
+
+Catalog is generated deterministically from vocabulary of card names,
+its base set has size of real catalog and it is scaled by synthetic sets.
+
+Latencies are divided by duration of fixed workload measured on the same
+machine, which scores labels like fuzzy search and counts their trigrams
+like index. This absorbs speed of machine, but not of scorer, so
+baselines stored in tests/benchmarks/search.json are recorded with
+python-Levenshtein from Pipfile and benchmarks skip without it. Run with
+BENCHMARK=record to store new ones.
+"""
+from bb8.search import ResultCache, Search, SearchIndex
+from collections import Counter
+from fuzzywuzzy import fuzz
+
+import json
+import os
+import pytest
+import random
+import string
+import time
+
+BENCHMARK = os.environ.get("BENCHMARK")
+BASELINES = "tests/benchmarks/search.json"
+
+# Number of cards in generated base set, roughly size of real catalog.
+CATALOG_SIZE = 1200
+# Number of queries measured in each benchmark.
+SAMPLES = 50
+# Number of times each query is measured, its fastest run is kept,
+# so scheduling hiccups do not show up as slow queries.
+ROUNDS = 3
+# Allowed slowdown against baseline before benchmark fails.
+TOLERANCE = 1.5
+# Allowed slowdown of fast queries, in calibration units, absorbing noise.
+NOISE = 0.05
+
+pytestmark = pytest.mark.skipif(not BENCHMARK,
+                                reason="Set BENCHMARK to run benchmarks")
+
+NAMES = [
+    "Rey", "Finn", "Poe Dameron", "Luke Skywalker", "Leia Organa",
+    "Han Solo", "Chewbacca", "Yoda", "Obi-Wan Kenobi", "Padme Amidala",
+    "Jyn Erso", "Cassian Andor", "Chirrut Imwe", "Baze Malbus", "Rose",
+    "Kylo Ren", "Darth Vader", "Darth Maul", "Captain Phasma",
+    "General Grievous", "Boba Fett", "Jango Fett", "Aurra Sing", "Bossk",
+    "Count Dooku", "Asajj Ventress", "Director Krennic", "Grand Moff Tarkin",
+    "Palpatine", "General Hux", "Snoke", "Jabba the Hutt", "Greedo",
+    "Lando Calrissian", "Qi'ra", "Enfys Nest", "Hera Syndulla", "Ezra Bridger",
+    "Sabine Wren", "Kanan Jarrus", "Thrawn", "Seventh Sister", "Mother Talzin"
+]
+TITLES = [
+    "Force Prodigy", "Ultimate Trooper", "Sith Lord", "Tortured Soul",
+    "Rebel Leader", "Scoundrel", "Jedi Master", "Bounty Hunter",
+    "Crime Lord", "Hero of the Rebellion", "Dark Lord of the Sith",
+    "Rogue Agent", "Loyal Companion", "Ruthless Tactician", "Smuggler",
+    "Imperial Officer", "Resistance Pilot", "Nightsister", "Outlaw"
+]
+ITEMS = [
+    "Lightsaber", "Blaster Pistol", "Thermal Detonator", "Holdout Blaster",
+    "Force Throw", "Force Choke", "Hidden Agenda", "Infamous", "Espionage",
+    "Emperor's Favor", "Black Market", "Scavenge", "Endless Ranks",
+    "Echo Base", "Command Center", "Jedi Temple", "Emperor's Throne Room",
+    "Cloud City", "Starship Graveyard", "Mos Eisley Cantina", "Rebel Ambush",
+    "Field Medic", "Electrostaff", "Vibroknife", "Bowcaster", "DL-44",
+    "Battle Fatigue", "No Mercy", "Premonitions", "Unpredictable"
+]
+
+
+def generate_catalog(rnd):
+    """
+    Generates base set of characters titled like real ones and other cards.
+    """
+    cards = []
+    for position in range(CATALOG_SIZE):
+        if position % 3 == 0:
+            label = f"{rnd.choice(NAMES)} - {rnd.choice(TITLES)}"
+        else:
+            label = rnd.choice(ITEMS)
+            if rnd.random() < 0.5:
+                label += " " + rnd.choice(["Mk II", "Prototype", "Veteran",
+                                           "Ancient", "Modified"])
+        cards.append({"code": f"01{position:04}", "label": label})
+    return cards
+
+
+def calibrate():
+    """
+    Measures fixed scoring and trigram workload in milliseconds,
+    the best of 5 runs.
+    """
+    rnd = random.Random(7)
+    labels = [card["label"].lower() for card in generate_catalog(rnd)]
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        grams = Counter()
+        for label in labels:
+            fuzz.partial_ratio("darth vader sith", label)
+            grams.update(SearchIndex.ngrams(label))
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def scale_catalog(cards, sets, rnd):
+    """
+    Adds synthetic sets, labels are built from words of base labels.
+    """
+    words = sorted({word for card in cards for word in card["label"].split()})
+    scaled = list(cards)
+    for set_number in range(1, sets):
+        for position, card in enumerate(cards):
+            label = " ".join(rnd.sample(words, rnd.randint(1, 4)))
+            scaled.append(dict(card, label=label,
+                               code=f"S{set_number:02}{position:04}"))
+    return scaled
+
+
+def typo(label, rnd):
+    if len(label) < 2:
+        return label
+    i = rnd.randrange(len(label) - 1)
+    return label[:i] + label[i + 1] + label[i] + label[i + 2:]
+
+
+def partial(label, rnd):
+    words = label.split()
+    return " ".join(words[:rnd.randint(1, len(words))])[:12]
+
+
+def miss(label, rnd):
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(8))
+
+
+QUERIES = {
+    "exact": lambda label, rnd: label,
+    "typo": typo,
+    "partial": partial,
+    "miss": miss
+}
+
+
+class StaticClient:
+    def __init__(self, cards):
+        self.cards = cards
+
+    async def get_cards(self):
+        return self.cards
+
+
+def percentile(latencies, percent):
+    ordered = sorted(latencies)
+    return ordered[round(percent / 100 * (len(ordered) - 1))]
+
+
+def check_baseline(name, result):
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES, encoding="utf-8") as baselines_file:
+            baselines = json.load(baselines_file)
+
+    if BENCHMARK == "record":
+        baselines[name] = result
+        os.makedirs(os.path.dirname(BASELINES), exist_ok=True)
+        with open(BASELINES, "w", encoding="utf-8") as baselines_file:
+            json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+        return
+
+    baseline = baselines.get(name)
+    if baseline is None:
+        pytest.skip(f"No baseline for {name}: {result}")
+
+    for metric in ["p50", "p99"]:
+        limit = baseline[metric] * TOLERANCE + NOISE
+        assert result[metric] <= limit, \
+            f"{name} {metric} regressed: {result[metric]:.2f} > {limit:.2f}"
+
+
+@pytest.fixture(scope="module")
+def unit_ms():
+    pytest.importorskip("Levenshtein")
+    return calibrate()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sets", [1, 4])
+@pytest.mark.parametrize("kind", sorted(QUERIES))
+async def test_find_card_latency(sets, kind, unit_ms):
+    rnd = random.Random(42)
+    cards = scale_catalog(generate_catalog(rnd), sets, rnd)
+    search = Search(StaticClient(cards), results=ResultCache(maxsize=0))
+    await search.find_card("warm up")
+
+    labels = [card["label"] for card in rnd.sample(cards, SAMPLES)]
+    queries = [QUERIES[kind](label, rnd) for label in labels]
+
+    latencies = []
+    started = time.perf_counter()
+    for query in queries:
+        timings = []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            await search.find_card(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies.append(min(timings))
+    elapsed = time.perf_counter() - started
+
+    p50 = percentile(latencies, 50)
+    p99 = percentile(latencies, 99)
+    result = {
+        "cards": len(cards),
+        "p50": round(p50 / unit_ms, 4),
+        "p99": round(p99 / unit_ms, 4)
+    }
+    print(f"{kind} x{sets}: p50 {p50:.2f} ms, p99 {p99:.2f} ms, "
+          f"{len(queries) * ROUNDS / elapsed:.1f} qps, {result}")
+
+    check_baseline(f"{kind}-x{sets}", result)
@@ -1,10 +1,17 @@
-from bb8.search import Search
+from bb8.metrics import SEARCH_QUERIES, SEARCH_SECONDS
+from bb8.search import (BKTree, BoundedExecutor, ResultCache, Search,
+                        SearchBusy, SearchIndex, edit_distance)
+from bb8.swdestinydb import CatalogChange
+from bb8.tracing import Trace
+from concurrent.futures import ThreadPoolExecutor
+from fuzzywuzzy import fuzz
 
 import pytest
+import threading
 
 
 class MockSWDestinyDBClient:
-    def get_cards(self):
+    async def get_cards(self):
         return [
             {
                 "code": "01001",
@@ -34,30 +41,356 @@ class MockSWDestinyDBClient:
         ]
 
 
+class StaticClient:
+    def __init__(self, cards):
+        self.cards = cards
+
+    async def get_cards(self):
+        return self.cards
+
+
 @pytest.fixture()
 def search():
     db_client = MockSWDestinyDBClient()
     return Search(db_client)
 
 
-def test_search_for_closest_match(search):
-    card = search.find_card("Captain Phasma ult")
+@pytest.mark.asyncio
+async def test_search_for_closest_match(search):
+    card = await search.find_card("Captain Phasma ult")
     assert card["code"] == "01001"
 
 
-def test_search_similar_matches(search):
-    card = search.find_card("captain phasma")
+@pytest.mark.asyncio
+async def test_search_similar_matches(search):
+    card = await search.find_card("captain phasma")
     assert card["code"] in ["01001", "01002"]
 
 
-def test_search_not_found_matches(search):
-    card = search.find_card("xxx")
+@pytest.mark.asyncio
+async def test_search_not_found_matches(search):
+    card = await search.find_card("xxx")
     assert not card
 
-def test_search_exact_match(search):
-    card = search.find_card("Rey - Force Prodigy")
+@pytest.mark.asyncio
+async def test_search_exact_match(search):
+    card = await search.find_card("Rey - Force Prodigy")
     assert card["code"] == "01004"
 
-def test_search_is_case_insensitive(search):
-    card = search.find_card("DARTH V")
+@pytest.mark.asyncio
+async def test_search_is_case_insensitive(search):
+    card = await search.find_card("DARTH V")
     assert card["code"] == "01005"
+
+
+@pytest.mark.asyncio
+async def test_search_reuses_index_of_unchanged_catalog():
+    cards = await MockSWDestinyDBClient().get_cards()
+    search = Search(StaticClient(cards))
+
+    await search.find_card("rey")
+    index = search.index
+    await search.refresh()
+
+    assert search.index is index
+
+
+@pytest.mark.asyncio
+async def test_search_revalidates_fresh_catalog_on_request():
+    class RevalidatedClient(StaticClient):
+        revalidations = 0
+
+        async def refresh(self):
+            self.revalidations += 1
+            self.cards = list(self.cards)
+            return True
+
+    db_client = RevalidatedClient(await MockSWDestinyDBClient().get_cards())
+    search = Search(db_client)
+
+    index = await search.refresh()
+    assert db_client.revalidations == 0
+
+    assert await search.refresh(revalidate=True) is not index
+    assert db_client.revalidations == 1
+
+
+@pytest.mark.asyncio
+async def test_search_rebuilds_index_of_changed_catalog(search):
+    await search.find_card("rey")
+    index = search.index
+    await search.refresh()
+
+    assert search.index is not index
+
+
+@pytest.mark.asyncio
+async def test_search_keeps_index_if_refresh_fails(search):
+    await search.find_card("rey")
+    index = search.index
+
+    async def fail():
+        raise ConnectionError()
+
+    search.db_client.get_cards = fail
+    with pytest.raises(ConnectionError):
+        await search.refresh()
+
+    assert search.index is index
+    assert (await search.find_card("darth maul"))["code"] == "01003"
+
+
+def test_index_shortlists_labels_sharing_trigrams():
+    cards = [{"label": label} for label in
+             ["Darth Maul", "Darth Vader - Sith Lord", "Rey - Force Prodigy"]]
+    index = SearchIndex(cards)
+
+    shortlist = index.shortlist(SearchIndex.normalize("darth v"))
+
+    assert [index.labels[position] for position in shortlist] == [
+        "Darth Maul", "Darth Vader - Sith Lord"
+    ]
+
+
+def test_index_falls_back_to_full_scan_for_weak_shortlist():
+    cards = [{"label": "Captain Phasma"}, {"label": "Rey"}]
+    index = SearchIndex(cards)
+
+    card, score = index.best_match("cpatian")
+
+    assert index.shortlist(SearchIndex.normalize("cpatian")) == []
+    assert card["label"] == "Captain Phasma"
+    assert score > 50
+
+
+@pytest.mark.asyncio
+async def test_search_caches_results_by_normalized_query(search):
+    await search.find_card("Darth Maul")
+    card = await search.find_card("  darth maul!")
+
+    assert card["code"] == "01003"
+    assert search.results.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+@pytest.mark.asyncio
+async def test_search_caches_not_found_results(search):
+    await search.find_card("xxx")
+
+    assert not await search.find_card("XXX")
+    assert search.results.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_search_invalidates_results_of_changed_catalog(search):
+    await search.find_card("rey")
+    await search.refresh()
+    await search.find_card("rey")
+
+    assert search.results.hits == 0
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = ResultCache(maxsize=2)
+    cache.put("rey", 1)
+    cache.put("maul", 2)
+    cache.get("rey")
+    cache.put("vader", 3)
+
+    assert cache.get("maul") is ResultCache.MISSING
+    assert cache.get("rey") == 1
+
+
+def test_result_cache_expires_results():
+    now = [0]
+    cache = ResultCache(ttl=10, clock=lambda: now[0])
+    cache.put("rey", None)
+
+    now[0] = 10
+
+    assert cache.get("rey") is ResultCache.MISSING
+
+
+@pytest.mark.asyncio
+async def test_search_finds_cards_in_query_order(search):
+    cards = await search.find_cards(["rey", "xxx", "darth maul", "REY"])
+
+    assert [card["code"] if card else None for card in cards] == [
+        "01004", None, "01003", "01004"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_search_runs_in_executor(search):
+    with ThreadPoolExecutor(1) as executor:
+        search.executor = BoundedExecutor(executor, 2)
+        card = await search.find_card("Captain Phasma ult")
+
+    assert card["code"] == "01001"
+
+
+def test_bounded_executor_rejects_tasks_when_full():
+    release = threading.Event()
+    with ThreadPoolExecutor(1) as pool:
+        executor = BoundedExecutor(pool, 1)
+        future = executor.submit(release.wait)
+
+        with pytest.raises(SearchBusy):
+            executor.submit(release.wait)
+
+        release.set()
+        future.result()
+        executor.submit(int).result()
+
+
+def test_index_patch_indexes_only_changed_cards():
+    rey = {"code": "01004", "label": "Rey - Force Prodigy"}
+    maul = {"code": "01003", "label": "Darth Maul"}
+    vader = {"code": "01005", "label": "Darth Vader - Sith Lord"}
+    finn = {"code": "02001", "label": "Finn"}
+    index = SearchIndex([rey, maul, vader])
+
+    patched = index.patch([rey, vader, finn], removed=[maul], added=[finn])
+
+    assert patched.best_match("finn")[0] is finn
+    assert patched.best_match("darth maul")[0] is vader
+    assert index.positions["Darth Maul"] not in patched.shortlist("darth maul")
+    assert index.best_match("darth maul")[0] is maul
+    assert "fin" not in index.grams
+
+
+def test_index_patch_keeps_label_of_reprinted_card():
+    throw = {"code": "01050", "label": "Force Throw"}
+    rey = {"code": "01004", "label": "Rey - Force Prodigy"}
+    reprint = {"code": "05050", "label": "Force Throw"}
+    index = SearchIndex([throw, rey, reprint])
+
+    patched = index.patch([throw, rey], removed=[reprint], added=[])
+
+    assert patched.best_match("force throw") == (throw, 100)
+    assert patched.best_match("force throw") == \
+        SearchIndex([throw, rey]).best_match("force throw")
+    assert patched.by_code["01050"] is throw
+    assert "05050" not in patched.by_code
+
+
+def test_index_patch_rebuilds_mostly_removed_index():
+    cards = [{"label": label} for label in ["Rey", "Finn", "Poe"]]
+    index = SearchIndex(cards)
+
+    patched = index.patch(cards[2:], removed=cards[:2], added=[])
+
+    assert patched.labels == ["Poe"]
+
+
+def test_edit_distance():
+    assert edit_distance("phasma", "phasma") == 0
+    assert edit_distance("phasma", "phamsa") == 2
+    assert edit_distance("ren", "ern") == 2
+    assert edit_distance("vader", "vadr") == 1
+    assert edit_distance("", "rey") == 3
+
+
+def test_bk_tree_finds_words_within_distance():
+    tree = BKTree(["phasma", "phantom", "vader", "maul", "rey"])
+
+    assert sorted(tree.find("phamsa", 2)) == ["phasma"]
+    assert sorted(tree.find("mal", 1)) == ["maul"]
+    assert tree.find("kylo", 1) == []
+
+
+def test_bk_tree_copy_does_not_modify_original():
+    tree = BKTree(["phasma", "vader"])
+
+    copy = tree.copy()
+    copy.add("phasmo")
+    copy.add("vadeer")
+
+    assert sorted(tree.find("phasmo", 1)) == ["phasma"]
+    assert sorted(copy.find("phasmo", 1)) == ["phasma", "phasmo"]
+    assert sorted(tree.find("vadeer", 1)) == ["vader"]
+
+
+def test_index_finds_typo_without_full_scan(mocker):
+    cards = [{"label": label} for label in
+             ["Captain Phasma - Ultimate Trooper", "Kylo Ren - Tortured Soul",
+              "Rey - Force Prodigy"]]
+    index = SearchIndex(cards)
+    scorer = mocker.spy(fuzz, "partial_ratio")
+
+    phasma, _ = index.best_match("phamsa")
+
+    assert phasma["label"] == "Captain Phasma - Ultimate Trooper"
+    assert scorer.call_count == 1
+    assert index.best_match("kylo ern")[0]["label"] == "Kylo Ren - Tortured Soul"
+
+
+def test_index_counts_scored_labels():
+    cards = [{"label": label} for label in
+             ["Captain Phasma - Ultimate Trooper", "Kylo Ren - Tortured Soul",
+              "Rey - Force Prodigy"]]
+    index = SearchIndex(cards)
+
+    _, typo_scored = index.best_matches(["phamsa"])
+    _, full_scored = index.best_matches(["zzz"])
+
+    assert typo_scored == 1
+    assert full_scored == 3
+
+
+def test_index_patch_indexes_words_of_added_labels():
+    rey = {"label": "Rey - Force Prodigy"}
+    index = SearchIndex([rey])
+    phasma = {"label": "Captain Phasma - Ultimate Trooper"}
+
+    patched = index.patch([rey, phasma], removed=[], added=[phasma])
+
+    assert patched.typo_candidates("phamsa") == {1}
+    assert index.typo_candidates("phamsa") == set()
+
+
+@pytest.mark.asyncio
+async def test_search_refresh_sets_patches_index(search):
+    await search.find_card("rey")
+    index = search.index
+    finn = {"code": "02001", "label": "Finn"}
+    cards = index.cards + [finn]
+
+    async def refresh_sets():
+        return CatalogChange(index.cards, cards, [], [finn])
+
+    search.db_client.refresh_sets = refresh_sets
+    await search.refresh_sets()
+
+    assert search.index.cards is cards
+    assert search.index.choices[:len(index.choices)] == index.choices
+    assert await search.find_card("finn") is finn
+
+
+@pytest.mark.asyncio
+async def test_search_finds_cards_by_code(search):
+    cards = await search.find_cards_by_code(["01004", "99999", "01001"])
+
+    assert cards[0]["label"] == "Rey - Force Prodigy"
+    assert cards[1] is None
+    assert cards[2]["label"] == "Captain Phasma - Ultimate Trooper"
+
+
+@pytest.mark.asyncio
+async def test_search_records_metrics(search):
+    searches = SEARCH_SECONDS.count()
+    queries = SEARCH_QUERIES.value()
+
+    await search.find_cards(["Rey", "Phasma"])
+
+    assert SEARCH_SECONDS.count() == searches + 1
+    assert SEARCH_QUERIES.value() == queries + 2
+
+
+@pytest.mark.asyncio
+async def test_search_traces_stages(search):
+    trace = Trace("mention")
+
+    await search.find_cards(["Rey"], trace)
+
+    assert list(trace.stages) == ["catalog", "cache", "scoring"]
+    assert 0 < trace.attrs["candidates"] < len(search.index.labels)
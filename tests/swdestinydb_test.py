@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
-from bb8.swdestinydb import SWDestinyDBClient
+from bb8.swdestinydb import (AsyncSWDestinyDBClient, CardCatalog,
+                             CardsResponse, SWDestinyDBClient)
 
+import aiohttp
+import asyncio
 import pytest
+import requests
 
 pytest.mark.usefixtures('betamax_recorder')
 
@@ -56,3 +60,343 @@ def test_get_sets(client):
     sets = client.get_sets()
 
     assert len(sets) > 0
+
+
+class MockResponse:
+    def __init__(self, status=200, data=None, headers=None, delay=0):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+        self.delay = delay
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.HttpProcessingError(code=self.status)
+
+    async def json(self):
+        return self.data
+
+
+class MockSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, uri, params=None, headers=None, timeout=None):
+        self.requests.append((uri, params, headers))
+        if len(self.responses) > 1:
+            return self.responses.pop(0)
+        return self.responses[0]
+
+
+def http_response(status, content=b"{}"):
+    response = requests.Response()
+    response.status_code = status
+    response._content = content
+    return response
+
+
+def test_request_retries_unavailable_api():
+    session = MockSession(http_response(503), http_response(200, b'{"code": "01001"}'))
+    client = SWDestinyDBClient(session=session, backoff=0)
+
+    card = client.get_card("01001")
+
+    assert card["code"] == "01001"
+    assert len(session.requests) == 2
+
+
+def test_request_fails_after_retries():
+    session = MockSession(http_response(503))
+    client = SWDestinyDBClient(session=session, retries=2, backoff=0)
+
+    with pytest.raises(requests.HTTPError):
+        client.get_card("01001")
+
+    assert len(session.requests) == 3
+
+
+def test_request_does_not_retry_client_errors():
+    session = MockSession(http_response(404))
+    client = SWDestinyDBClient(session=session, backoff=0)
+
+    with pytest.raises(requests.HTTPError):
+        client.get_card("01001")
+
+    assert len(session.requests) == 1
+
+
+def test_get_cards_by_keys():
+    session = MockSession(http_response(200, b'{"code": "01001"}'))
+    client = SWDestinyDBClient(session=session)
+
+    cards = client.get_cards_by_keys(["01001", "01002"])
+
+    assert len(cards) == 2
+    assert sorted(uri for uri, _, _ in session.requests) == [
+        "https://swdestinydb.com/api/public/card/01001.json",
+        "https://swdestinydb.com/api/public/card/01002.json"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_async_get_card():
+    session = MockSession(MockResponse(data={"code": "01001"}))
+    client = AsyncSWDestinyDBClient(session=session)
+
+    card = await client.get_card("01001")
+
+    assert card["code"] == "01001"
+    assert session.requests[0][0] == "https://swdestinydb.com/api/public/card/01001.json"
+
+
+@pytest.mark.asyncio
+async def test_async_get_cards_not_modified():
+    session = MockSession(MockResponse(status=304))
+    client = AsyncSWDestinyDBClient(session=session)
+
+    response = await client.get_cards_if_modified(etag='"v1"')
+
+    assert response == CardsResponse(None, '"v1"', None)
+    assert session.requests[0][2] == {"If-None-Match": '"v1"'}
+
+
+@pytest.mark.asyncio
+async def test_async_request_retries_unavailable_api():
+    session = MockSession(MockResponse(503), MockResponse(data={"code": "01001"}))
+    client = AsyncSWDestinyDBClient(session=session, backoff=0)
+
+    card = await client.get_card("01001")
+
+    assert card["code"] == "01001"
+    assert len(session.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_get_cards_by_keys():
+    session = MockSession(MockResponse(data={"code": "01001"}))
+    client = AsyncSWDestinyDBClient(session=session, pool_size=1)
+
+    cards = await client.get_cards_by_keys(["01001", "01002", "01003"])
+
+    assert len(cards) == 3
+    assert len(session.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_async_coalesces_concurrent_identical_requests():
+    session = MockSession(MockResponse(data=[{"code": "01001"}], delay=0.01))
+    client = AsyncSWDestinyDBClient(session=session)
+
+    results = await asyncio.gather(
+        client.get_cards(),
+        client.get_cards(),
+        client.get_cards("AW")
+    )
+
+    assert results[0] is results[1]
+    assert len(session.requests) == 2
+    assert client.stats() == {"sent": 2, "coalesced": 1}
+    assert client.in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_async_request_fails_on_error_status():
+    client = AsyncSWDestinyDBClient(session=MockSession(MockResponse(404)))
+
+    with pytest.raises(aiohttp.HttpProcessingError):
+        await client.get_sets()
+
+
+class MockCatalogClient:
+    def __init__(self, *responses, sets=()):
+        self.responses = list(responses)
+        self.requests = []
+        self.sets = list(sets)
+
+    async def get_sets(self):
+        return self.sets
+
+    async def get_cards_if_modified(self, etag=None, last_modified=None):
+        self.requests.append((etag, last_modified))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+CARDS = [{"code": "01001", "label": "Captain Phasma"}]
+
+
+@pytest.mark.asyncio
+async def test_catalog_is_cached_in_memory():
+    db_client = MockCatalogClient(CardsResponse(CARDS, '"v1"', None))
+    catalog = CardCatalog(db_client, clock=Clock())
+
+    assert await catalog.get_cards() == CARDS
+    assert await catalog.get_cards() is await catalog.get_cards()
+    assert len(db_client.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_catalog_revalidates_stale_cards():
+    clock = Clock()
+    db_client = MockCatalogClient(
+        CardsResponse(CARDS, '"v1"', "Mon, 01 Jan 2018 00:00:00 GMT"),
+        CardsResponse(None, '"v1"', "Mon, 01 Jan 2018 00:00:00 GMT")
+    )
+    catalog = CardCatalog(db_client, ttl=60, clock=clock)
+    cards = await catalog.get_cards()
+
+    clock.now += 60
+
+    assert await catalog.get_cards() is cards
+    assert catalog.version == 1
+    assert db_client.requests[1] == ('"v1"', "Mon, 01 Jan 2018 00:00:00 GMT")
+
+
+@pytest.mark.asyncio
+async def test_catalog_replaces_modified_cards():
+    clock = Clock()
+    new_cards = CARDS + [{"code": "01002", "label": "Darth Vader"}]
+    db_client = MockCatalogClient(
+        CardsResponse(CARDS, '"v1"', None),
+        CardsResponse(new_cards, '"v2"', None)
+    )
+    catalog = CardCatalog(db_client, ttl=60, clock=clock)
+    await catalog.get_cards()
+
+    clock.now += 60
+
+    assert await catalog.get_cards() == new_cards
+    assert catalog.version == 2
+    assert catalog.etag == '"v2"'
+
+
+@pytest.mark.asyncio
+async def test_catalog_keeps_cards_if_revalidation_fails():
+    clock = Clock()
+    db_client = MockCatalogClient(
+        CardsResponse(CARDS, '"v1"', None),
+        requests.ConnectionError()
+    )
+    catalog = CardCatalog(db_client, ttl=60, clock=clock)
+    await catalog.get_cards()
+
+    clock.now += 60
+
+    assert await catalog.get_cards() == CARDS
+    assert not catalog.is_stale()
+
+
+@pytest.mark.asyncio
+async def test_catalog_survives_restart(tmpdir):
+    path = str(tmpdir.join("catalog.json"))
+    clock = Clock()
+    db_client = MockCatalogClient(CardsResponse(CARDS, '"v1"', None))
+    await CardCatalog(db_client, path=path, clock=clock).get_cards()
+
+    restarted_client = MockCatalogClient()
+    catalog = CardCatalog(restarted_client, path=path, clock=clock)
+
+    assert await catalog.get_cards() == CARDS
+    assert catalog.etag == '"v1"'
+    assert restarted_client.requests == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("snapshot", ["{}", "[]", '{"cards": 1}',
+                                      '{"cards": [1]}'])
+async def test_catalog_ignores_malformed_snapshot(tmpdir, snapshot):
+    path = tmpdir.join("catalog.json")
+    path.write(snapshot)
+    db_client = MockCatalogClient(CardsResponse(CARDS, '"v1"', None))
+    catalog = CardCatalog(db_client, path=str(path), clock=Clock())
+
+    assert await catalog.get_cards() == CARDS
+    assert len(db_client.requests) == 1
+
+
+class MockSetsClient:
+    def __init__(self, sets, cards):
+        self.sets = sets
+        self.cards = cards
+        self.requested_sets = []
+
+    async def get_sets(self):
+        return self.sets
+
+    async def get_cards(self, set_code=None):
+        self.requested_sets.append(set_code)
+        return self.cards[set_code]
+
+
+@pytest.mark.asyncio
+async def test_catalog_refreshes_only_changed_sets():
+    db_client = MockSetsClient(
+        [{"code": "AW", "total": 1}, {"code": "SoR", "total": 1}],
+        {
+            "AW": [{"code": "01001", "set_code": "AW", "label": "Captain Phasma"}],
+            "SoR": [{"code": "02001", "set_code": "SoR", "label": "Rey"}]
+        }
+    )
+    catalog = CardCatalog(db_client, clock=Clock())
+    await catalog.refresh_sets()
+
+    db_client.sets[1] = {"code": "SoR", "total": 2}
+    db_client.cards["SoR"].append({"code": "02002", "set_code": "SoR", "label": "Finn"})
+    db_client.requested_sets = []
+    change = await catalog.refresh_sets()
+
+    assert db_client.requested_sets == ["SoR"]
+    assert [card["code"] for card in change.removed] == ["02001"]
+    assert [card["code"] for card in change.added] == ["02001", "02002"]
+    assert [card["code"] for card in catalog.cards] == ["01001", "02001", "02002"]
+    assert change.cards is catalog.cards
+
+
+@pytest.mark.asyncio
+async def test_catalog_refresh_of_unchanged_sets_keeps_cards():
+    db_client = MockSetsClient(
+        [{"code": "AW", "total": 1}],
+        {"AW": [{"code": "01001", "set_code": "AW", "label": "Captain Phasma"}]}
+    )
+    catalog = CardCatalog(db_client, clock=Clock())
+    await catalog.refresh_sets()
+    cards = catalog.cards
+
+    change = await catalog.refresh_sets()
+
+    assert change.added == change.removed == []
+    assert catalog.cards is cards
+    assert catalog.version == 1
+
+
+@pytest.mark.asyncio
+async def test_catalog_full_refresh_seeds_sets():
+    sets = [{"code": "AW", "total": 1}]
+    db_client = MockCatalogClient(CardsResponse(CARDS, '"v1"', None),
+                                  sets=sets)
+    catalog = CardCatalog(db_client, clock=Clock())
+    await catalog.get_cards()
+
+    change = await catalog.refresh_sets()
+
+    assert list(catalog.sets) == ["AW"]
+    assert change.added == change.removed == []
+    assert change.cards == CARDS
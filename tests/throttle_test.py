@@ -0,0 +1,65 @@
+from bb8.throttle import DedupWindow, UserThrottle
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_dedup_window_suppresses_repeated_lookup():
+    clock = Clock()
+    dedup = DedupWindow(window=10, clock=clock)
+
+    assert not dedup.seen(("destiny", "rey"))
+    assert not dedup.seen(("general", "rey"))
+    clock.now = 9
+    assert dedup.seen(("destiny", "rey"))
+
+
+def test_dedup_window_forgets_expired_lookup():
+    clock = Clock()
+    dedup = DedupWindow(window=10, clock=clock)
+
+    dedup.seen(("destiny", "rey"))
+    clock.now = 5
+    dedup.seen(("destiny", "rey"))
+    clock.now = 10
+
+    assert not dedup.seen(("destiny", "rey"))
+
+
+def test_dedup_window_forgets_lookup_on_request():
+    dedup = DedupWindow(window=10, clock=Clock())
+
+    dedup.seen(("destiny", "rey"))
+    dedup.forget(("destiny", "rey"))
+    dedup.forget(("destiny", "phasma"))
+
+    assert not dedup.seen(("destiny", "rey"))
+
+
+def test_dedup_window_is_bounded():
+    dedup = DedupWindow(maxsize=2, clock=Clock())
+
+    for query in ["rey", "phasma", "kylo"]:
+        dedup.seen(query)
+
+    assert list(dedup.entries) == ["phasma", "kylo"]
+    assert not dedup.seen("rey")
+
+
+def test_user_throttle_limits_each_user():
+    clock = Clock()
+    throttle = UserThrottle(rate=2, per=10, clock=clock)
+
+    assert throttle.allow(1)
+    assert throttle.allow(1)
+    assert not throttle.allow(1)
+    assert throttle.allow(2)
+
+    clock.now = 5
+    assert throttle.allow(1)
+    assert not throttle.allow(1)
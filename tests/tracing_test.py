@@ -0,0 +1,79 @@
+from bb8.tracing import NULL_TRACE, Trace, Tracer
+
+import json
+import logging
+
+
+def test_trace_accumulates_stages():
+    trace = Trace("mention", query=["rey"])
+
+    trace.add("send", 0.25)
+    trace.add("render", 0.125)
+    trace.add("send", 0.25)
+    trace.finish()
+
+    record = trace.to_dict()
+    assert record["name"] == "mention"
+    assert record["query"] == ["rey"]
+    assert list(record["stages"].items()) == [("send", 500), ("render", 125)]
+
+
+def test_null_trace_ignores_stages():
+    with NULL_TRACE.span("search"):
+        pass
+
+    assert not NULL_TRACE.stages
+
+
+def test_tracer_logs_slow_request(caplog):
+    tracer = Tracer(threshold=0)
+
+    with caplog.at_level(logging.WARNING, logger="bb8.slow"):
+        with tracer.trace("card", query="rey") as trace:
+            with trace.span("search"):
+                pass
+
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["name"] == "card"
+    assert record["query"] == "rey"
+    assert list(record["stages"]) == ["search"]
+
+
+def test_tracer_reports_held_request_when_released(caplog):
+    tracer = Tracer(threshold=0)
+
+    with caplog.at_level(logging.WARNING, logger="bb8.slow"):
+        with tracer.trace("card", query="rey") as trace:
+            trace.hold()
+        assert not [r for r in caplog.records if r.name == "bb8.slow"]
+
+        trace.add("send", 0.25)
+        trace.release()
+
+    record = json.loads(caplog.records[-1].getMessage())
+    assert list(record["stages"]) == ["send"]
+    assert record["elapsed_ms"] >= 0
+
+
+def test_tracer_ignores_fast_request(caplog):
+    tracer = Tracer(threshold=60)
+
+    with caplog.at_level(logging.INFO, logger="bb8.slow"):
+        with tracer.trace("card", query="rey"):
+            pass
+
+    assert not [r for r in caplog.records if r.name == "bb8.slow"]
+
+
+def test_tracer_profiles_sampled_request(caplog):
+    tracer = Tracer(threshold=60, profile_rate=0.5, random=lambda: 0.25)
+
+    with caplog.at_level(logging.INFO, logger="bb8.slow"):
+        with tracer.trace("card", query="rey"):
+            sorted(range(100))
+
+    messages = [r.getMessage() for r in caplog.records if r.name == "bb8.slow"]
+    assert len(messages) == 1
+    assert messages[0].startswith("Profile of")
+    assert "function calls" in messages[0]
+    assert not tracer.profiling